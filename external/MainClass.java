@@ -1,5 +1,14 @@
 package minutiaeextraction;
 
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.nio.charset.StandardCharsets;
 import java.util.Base64;
 import java.nio.file.Files;
 import java.nio.file.Path;
@@ -8,24 +17,84 @@ import com.machinezoo.sourceafis.*;
 
 public class MainClass {
 
+	// Request payload kinds of the worker protocol
+	private static final byte KIND_PATH = 0;  // The payload is the UTF-8 path of the image file
+	private static final byte KIND_IMAGE = 1;  // The payload is the encoded image itself
+	// Response statuses of the worker protocol
+	private static final byte STATUS_OK = 0;  // The payload is the serialized (CBOR) SourceAFIS template
+	private static final byte STATUS_ERROR = 1;  // The payload is the UTF-8 error message
+
 	public static void main(String[] args) {
+		if (args.length > 0 && args[0].equals("--worker")) {  // Long-lived worker mode
+			try {
+				serve();
+			}
+			catch(IOException e) {
+				e.printStackTrace();
+			}
+			return;
+		}
 		Path path = Path.of(args[0]);
 		Double dpi = Double.parseDouble(args[1]);
 //		System.out.println(path);
 		try {
 			byte[] encodedImg = Files.readAllBytes(path);
-			FingerprintImageOptions opt = new FingerprintImageOptions().dpi(dpi);
-			FingerprintImage img = new FingerprintImage(encodedImg, opt);
-			FingerprintTemplate temp = new FingerprintTemplate(img);
-			String b64temp = Base64.getEncoder().encodeToString(temp.toByteArray());
+			String b64temp = Base64.getEncoder().encodeToString(extract(encodedImg, dpi));
 			System.out.println(b64temp);
-		
+
 		}
 		catch(Exception e) {
 			e.printStackTrace();
-			
+
+		}
+
+	}
+
+	private static byte[] extract(byte[] encodedImg, double dpi) {
+		FingerprintImageOptions opt = new FingerprintImageOptions().dpi(dpi);
+		FingerprintImage img = new FingerprintImage(encodedImg, opt);
+		FingerprintTemplate temp = new FingerprintTemplate(img);
+		return temp.toByteArray();
+	}
+
+	/*
+	 * Serve framed extraction requests on stdin until it is closed.
+	 * Request: int32 id, int8 kind, float64 dpi, int32 length, payload (all big-endian)
+	 * Response: int32 id, int8 status, int32 length, payload
+	 */
+	private static void serve() throws IOException {
+		DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+		DataOutputStream out = new DataOutputStream(new BufferedOutputStream(new FileOutputStream(FileDescriptor.out)));
+		System.setOut(System.err);  // Keep stray library output away from the response stream
+		while (true) {
+			int id;
+			try {
+				id = in.readInt();
+			}
+			catch(EOFException e) {  // The client closed the pipe
+				break;
+			}
+			byte kind = in.readByte();
+			double dpi = in.readDouble();
+			byte[] payload = new byte[in.readInt()];
+			in.readFully(payload);
+			byte status;
+			byte[] response;
+			try {
+				byte[] encodedImg = kind == KIND_PATH ? Files.readAllBytes(Path.of(new String(payload, StandardCharsets.UTF_8))) : payload;
+				response = extract(encodedImg, dpi);
+				status = STATUS_OK;
+			}
+			catch(Exception e) {
+				response = String.valueOf(e).getBytes(StandardCharsets.UTF_8);
+				status = STATUS_ERROR;
+			}
+			out.writeInt(id);
+			out.writeByte(status);
+			out.writeInt(response.length);
+			out.write(response);
+			out.flush();
 		}
-		
 	}
 
 }
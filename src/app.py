@@ -1,22 +1,37 @@
 import readwrite as rw
 from minutiae import MinutiaPoint
 from homomorphic_template import HomomorphicTemplate
-from phe import paillier
+from index_template import IndexTemplate
+from gallery import IndexGallery, gallery_file_name
+from keypair_pool import KeypairPool, keypair_pool_file_name
+import instrumentation
+import json
+import os
 
 if __name__ == "__main__":
     # Keyring is used to store the private keys
-    if not rw.check_keyring_existence():  # Check if the keyring doesn't exist
-        keyring = paillier.PaillierPrivateKeyring()  # Create a new keyring
-    else:
-        keyring = rw.load_keyring()  # Load the keyring
+    keyring = rw.open_keyring()  # Load the private keys on demand
+    gallery = IndexGallery.open(os.path.join(rw.assets_dir, gallery_file_name))  # The gallery of the enrolled indexes (1:N identification), built from the store if missing
+    key_pool = KeypairPool(os.path.join(rw.assets_dir, keypair_pool_file_name))  # Keypairs generated ahead of time
+    key_pool.fill_in_background()
     print("Secure Fingerprint Verification System\n")
     while True:
         print("1. Enroll a user")
         print("2. Verify a user")
-        print("3. Exit")
+        print("3. Identify a user")
+        print("4. Add a fingerprint image to a user")
+        print("5. Exit")
         choice = input("Enter your choice: ")
-        if choice == '3':
+        if choice == '5':
             print("Exiting...")
+            key_pool.stop()
+            if instrumentation.enabled:  # Export the stage timings and counters of the session
+                with open(os.path.join(rw.assets_dir, "metrics.json"), "w") as f:
+                    json.dump(instrumentation.snapshot(), f, indent=1)
+                    f.close()
+                with open(os.path.join(rw.assets_dir, "metrics.prom"), "w") as f:
+                    f.write(instrumentation.prometheus())
+                    f.close()
             break
         elif choice == '1':  # Enroll a user
             username = input("Enter the username: ")
@@ -24,7 +39,7 @@ if __name__ == "__main__":
                 print("User already exists! Please try again.\n")
                 continue
             else:
-                pubk,_ = paillier.generate_paillier_keypair(keyring)  # Generate a new public-private key pair
+                pubk,_ = key_pool.generate_keypair(keyring)  # Take (or generate) a new public-private key pair
                 print("To enroll a user, please provide 3 fingerprint images.\n")
                 print("Please enter the image ids.\n")
                 minutiae_points = []  # A list to store the minutiae points of the fingerprint images
@@ -50,6 +65,9 @@ if __name__ == "__main__":
                         break
                 print("Enrolling user...")
                 template = HomomorphicTemplate(username,minutiae_points,True, pubk)  # Create the template
+                index = IndexTemplate(username, reference=True)
+                index.read_template()
+                gallery.add(username, index.get_features())  # Make the user identifiable
                 print("User {} enrolled successfully!\n".format(username))
         elif choice == '2':  # Verify a user
             username = input("Enter the username: ")
@@ -70,9 +88,43 @@ if __name__ == "__main__":
                 query = HomomorphicTemplate(username,img_minutiae)  # Create the query template
                 # Fetch the reference template
                 ref = HomomorphicTemplate(username,reference=True)  
-                ref.read_template()
+                ref.read_template(lazy=True)  # Only the ciphertexts at the query's 1's are needed
                 match = HomomorphicTemplate.match_templates(ref, query)  # Compare the templates
-                match = keyring.decrypt(match)  # Decrypt similarity score
+                with instrumentation.timed("decrypt"):
+                    match = keyring.decrypt(match)  # Decrypt similarity score
+                instrumentation.count("ciphertexts.decrypted")
                 print("Matching score: {}\n".format(match))
+        elif choice == '3':  # Identify a user
+            print("To identify a user, please provide a fingerprint image.\n")
+            img_name = input("Enter the image id: ")
+            try:
+                img_path = rw.get_image_path(img_name)  # Get the image path
+            except FileNotFoundError:
+                print("The image requested does not exist. Please try again.\n")
+                continue
+            img_minutiae = MinutiaPoint.extract_minutiae(img_path)
+            print("Identifying user...")
+            query = IndexTemplate(None, img_minutiae)  # Create the query template
+            for rank, (candidate, score) in enumerate(gallery.identify(query.get_features()), 1):  # Rank the enrolled users
+                print("{}. {} (score: {})".format(rank, candidate, score))
+            print()
+        elif choice == '4':  # Add a fingerprint image to an enrolled user
+            username = input("Enter the username: ")
+            if not rw.check_user_existence(username):  # Check if the user exists
+                print("User does not exist! Please try again.\n")
+                continue
+            img_name = input("Enter the image id: ")
+            try:
+                img_path = rw.get_image_path(img_name)  # Get the image path
+            except FileNotFoundError:
+                print("The image requested does not exist. Please try again.\n")
+                continue
+            img_minutiae = MinutiaPoint.extract_minutiae(img_path)
+            print("Updating user...")
+            changed = HomomorphicTemplate.update_template(username, img_minutiae)  # Only the changed ciphertexts are rewritten
+            index = IndexTemplate(username, reference=True)
+            index.read_template()
+            gallery.add(username, index.get_features())  # Keep the identification index in sync
+            print("User {} updated successfully! ({} ciphertexts re-encrypted)\n".format(username, changed))
         else:
             print("Invalid choice! Please try again.\n")
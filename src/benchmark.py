@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import numpy as np
+from phe import paillier
+from minutiae import MinutiaPoint
+
+default_minutiae_counts = (20, 40, 80)  # The numbers of minutiae per synthetic image
+default_key_sizes = (512, 1024)  # The Paillier key sizes in bits
+default_encrypt_count = 1024  # The number of values encrypted by the encryption benchmark
+default_repeat = 5  # The number of timed runs of the fast benchmarks
+default_fingers = 50  # The number of synthetic fingers of the accuracy measurements
+
+
+def synthetic_minutiae(count, rng, x_length=504, y_length=480):
+    '''
+        Generate the minutiae points of a synthetic fingerprint image
+        :param count: The number of minutiae points
+        :param rng: The random.Random generator
+        :param x_length: The length of the image in the x-axis
+        :param y_length: The length of the image in the y-axis
+        :return: The list of the MinutiaPoint objects
+    '''
+    return [MinutiaPoint(rng.randrange(x_length), rng.randrange(y_length), rng.uniform(0, 2*np.pi), rng.randrange(2))
+            for _ in range(count)]
+
+
+def synthetic_impression(minutiae, rng, shift=4, rotation=0.05, dropout=0.1, x_length=504, y_length=480):
+    '''
+        Generate another impression of a synthetic finger: the minutiae are jittered and some are missed
+        :param minutiae: The minutiae points of the finger
+        :param rng: The random.Random generator
+        :param shift: The maximum displacement of a minutia in pixels
+        :param rotation: The maximum rotation of a minutia in radians
+        :param dropout: The probability of a minutia to be missed
+        :return: The list of the MinutiaPoint objects
+    '''
+    impression = []
+    for m in minutiae:
+        if rng.random() < dropout:
+            continue
+        x = min(max(m.x + rng.randint(-shift, shift), 0), x_length - 1)
+        y = min(max(m.y + rng.randint(-shift, shift), 0), y_length - 1)
+        impression.append(MinutiaPoint(x, y, (m.theta + rng.uniform(-rotation, rotation)) % (2*np.pi), m.type))
+    return impression
+
+
+def measure(func, repeat):
+    '''
+        Time a function
+        :param func: The function, called without arguments
+        :param repeat: The number of timed calls
+        :return: The list of the durations in seconds
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+class Benchmark:
+    '''
+        The benchmarks of the template and matching stages, on synthetic minutiae (no JVM or images needed)
+        Templates are stored in a temporary template store, so the assets are never touched
+    '''
+
+    def __init__(self, minutiae_counts=default_minutiae_counts, key_sizes=default_key_sizes, repeat=default_repeat,
+                 encrypt_count=default_encrypt_count, fingers=default_fingers, seed=0):
+        '''
+            :param minutiae_counts: The numbers of minutiae per synthetic image
+            :param key_sizes: The Paillier key sizes in bits
+            :param repeat: The number of timed runs of the fast benchmarks (the homomorphic construction runs once)
+            :param encrypt_count: The number of values encrypted by the encryption benchmark
+            :param fingers: The number of synthetic fingers of the accuracy measurements
+            :param seed: The seed of the synthetic minutiae and the encrypted values
+        '''
+        self._minutiae_counts = minutiae_counts
+        self._key_sizes = key_sizes
+        self._repeat = repeat
+        self._encrypt_count = encrypt_count
+        self._fingers = fingers
+        self._seed = seed
+        self.results = []
+
+    def _record(self, name, params, times):
+        self.results.append({"name": name, "params": params, "times": times, "min": min(times),
+                             "median": float(np.median(times)), "mean": float(np.mean(times))})
+        print("{:<32} {:<40} {:>12.6f}s".format(name, json.dumps(params, sort_keys=True), min(times)), file=sys.stderr)
+
+    def run(self):
+        '''
+            Run every benchmark, in a temporary working directory
+            :return: The list of the results
+        '''
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.mkdir(os.path.join(tmp, "assets"))
+            os.chdir(tmp)  # The template store is created under the temporary assets/
+            try:
+                self._run_templates()
+                self._run_reduction()
+                self._run_encryption()
+            finally:
+                os.chdir(cwd)
+        return self.results
+
+    def _run_templates(self):
+        from pair_template import FingerprintTemplate
+        from binary_template import BinaryTemplate
+        from index_template import IndexTemplate
+        from template_set import TemplateSet
+        for count in self._minutiae_counts:
+            rng = random.Random(self._seed)
+            finger = synthetic_minutiae(count, rng)
+            enrollment = [synthetic_impression(finger, rng) for _ in range(3)]
+            genuine = synthetic_impression(finger, rng)
+            params = {"minutiae": count}
+            self._record("pairs", params, measure(lambda: FingerprintTemplate(None, genuine), self._repeat))
+            for name, cls in (("raw", FingerprintTemplate), ("binary", BinaryTemplate), ("index", IndexTemplate)):
+                username = "bench_{}_{}".format(name, count)
+                self._record(name + ".query", params, measure(lambda: cls(None, genuine), self._repeat))
+                self._record(name + ".reference", params, measure(lambda: cls(username, enrollment, True), self._repeat))
+                reference = cls(username, reference=True)
+                self._record(name + ".read", params, measure(reference.read_template, self._repeat))
+                query = cls(None, genuine)
+                self._record(name + ".match", params, measure(lambda: cls.match_templates(reference, query), self._repeat))
+            self._record("set.query", params, measure(lambda: TemplateSet(None, genuine), self._repeat))  # All the query representations at once
+
+    def _record_accuracy(self, name, params, scores, genuine):
+        from roc import equal_error_rate
+        scores = np.asarray(scores)
+        genuine = np.asarray(genuine, dtype=bool)
+        eer, threshold = equal_error_rate(scores, genuine)
+        self.results.append({"name": name, "params": params, "eer": float(eer), "threshold": float(threshold),
+                             "genuine_mean": float(scores[genuine].mean()), "impostor_mean": float(scores[~genuine].mean())})
+        print("{:<32} {:<40} {:>12.4f} EER".format(name, json.dumps(params, sort_keys=True), eer), file=sys.stderr)
+
+    def _run_reduction(self):
+        from index_template import IndexTemplate
+        from homomorphic_template import HomomorphicTemplate
+        count = max(self._minutiae_counts)
+        rng = random.Random(self._seed)
+        fingers = [synthetic_minutiae(count, rng) for _ in range(self._fingers)]
+        references = [IndexTemplate(None, [synthetic_impression(f, rng) for _ in range(3)]) for f in fingers]
+        queries = [IndexTemplate(None, synthetic_impression(f, rng)) for f in fingers]
+        params = {"minutiae": count, "size": HomomorphicTemplate._vector_size}
+        positions = queries[0].index_positions(queries[0].get_features())
+        self._record("reduce", params, measure(lambda: HomomorphicTemplate.reduce_positions("bench", positions), self._repeat))
+        # The similarity scores of every reference with every query, on the full and on the reduced vectors
+        full, reduced, genuine = [], [], []
+        for r, (ref, user) in enumerate(zip(references, ("user{}".format(i) for i in range(len(references))))):
+            ref_reduced = HomomorphicTemplate.reduce_positions(user, ref.index_positions(ref.get_features()))
+            for q, query in enumerate(queries):
+                full.append(IndexTemplate.match_templates(ref, query))
+                query_reduced = HomomorphicTemplate.reduce_positions(user, query.index_positions(query.get_features()))
+                reduced.append(np.intersect1d(ref_reduced, query_reduced).size / max(len(query_reduced), 1))
+                genuine.append(r == q)
+        params = dict(params, fingers=self._fingers)
+        self._record_accuracy("accuracy.index", params, full, genuine)
+        self._record_accuracy("accuracy.reduced", params, reduced, genuine)
+
+    def _run_encryption(self):
+        from encryption import encrypt_vector
+        from index_template import IndexTemplate
+        from homomorphic_template import HomomorphicTemplate
+        from ciphertext_file import CiphertextFile, serialize_ciphertexts
+        from decryption import DecryptionService
+        count = max(self._minutiae_counts)
+        rng = random.Random(self._seed)
+        finger = synthetic_minutiae(count, rng)
+        enrollment = [synthetic_impression(finger, rng) for _ in range(3)]
+        query = IndexTemplate(None, synthetic_impression(finger, rng))
+        modes = HomomorphicTemplate._packed, HomomorphicTemplate._reduced
+        for bits in self._key_sizes:
+            params = {"key_bits": bits}
+            pubkey, privkey = paillier.generate_paillier_keypair(n_length=bits)
+            keyring = paillier.PaillierPrivateKeyring([privkey])
+            values = [rng.randrange(2) for _ in range(self._encrypt_count)]
+            self._record("encrypt", dict(params, values=self._encrypt_count),
+                         measure(lambda: encrypt_vector(pubkey, values, processes=1), self._repeat))
+            encrypted = encrypt_vector(pubkey, values, processes=1)
+            data = serialize_ciphertexts(pubkey, encrypted)
+            self._record("ciphertexts.serialize", dict(params, values=self._encrypt_count),
+                         measure(lambda: serialize_ciphertexts(pubkey, encrypted), self._repeat))
+            self._record("ciphertexts.parse", dict(params, values=self._encrypt_count),
+                         measure(lambda: CiphertextFile(data).encrypted_numbers(), self._repeat))
+            for packed, reduced in ((True, False), (False, False), (True, True), (False, True)):
+                params = {"key_bits": bits, "minutiae": count, "packed": packed, "reduced": reduced}
+                username = "bench_homomorphic_{}_{}_{}".format(bits, packed, reduced)
+                HomomorphicTemplate._packed, HomomorphicTemplate._reduced = packed, reduced
+                try:
+                    self._record("homomorphic.reference", params, measure(lambda: HomomorphicTemplate(username, enrollment, True, pubkey), 1))
+                finally:
+                    HomomorphicTemplate._packed, HomomorphicTemplate._reduced = modes
+                reference = HomomorphicTemplate(username, reference=True)
+                self._record("homomorphic.read", params, measure(reference.read_template, self._repeat))
+                self._record("homomorphic.read_lazy", params, measure(lambda: reference.read_template(lazy=True), self._repeat))
+                reference.read_template(lazy=True)
+                self._record("homomorphic.match", params, measure(lambda: HomomorphicTemplate.match_templates(reference, query), self._repeat))
+                scores = [HomomorphicTemplate.match_templates(reference, query)] * 64
+                decryptor = DecryptionService(keyring, processes=1)
+                self._record("decrypt", dict(params, scores=len(scores)), measure(lambda: decryptor.decrypt_many(scores), self._repeat))
+
+
+def compare(baseline, results):
+    '''
+        Compare results with the results of an earlier run
+        :param baseline: The results of the earlier run
+        :param results: The results of this run
+        :return: A list of (name, params, baseline min, min, ratio) tuples of the benchmarks of both runs
+    '''
+    before = {(r["name"], json.dumps(r["params"], sort_keys=True)): r["min"] for r in baseline if "min" in r}
+    rows = []
+    for r in results:
+        key = (r["name"], json.dumps(r["params"], sort_keys=True))
+        if key in before and "min" in r:
+            rows.append((r["name"], r["params"], before[key], r["min"], r["min"] / before[key] if before[key] else float("inf")))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the template and matching stages, on synthetic minutiae")
+    parser.add_argument("--minutiae", type=int, nargs="+", default=list(default_minutiae_counts), help="The numbers of minutiae per image")
+    parser.add_argument("--key-sizes", type=int, nargs="+", default=list(default_key_sizes), help="The Paillier key sizes in bits")
+    parser.add_argument("--repeat", type=int, default=default_repeat)
+    parser.add_argument("--encrypt-count", type=int, default=default_encrypt_count)
+    parser.add_argument("--fingers", type=int, default=default_fingers, help="The number of synthetic fingers of the accuracy measurements")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file (default: stdout)")
+    parser.add_argument("--compare", help="A JSON file of an earlier run, to print the time ratios against")
+    args = parser.parse_args()
+    bench = Benchmark(args.minutiae, args.key_sizes, args.repeat, args.encrypt_count, args.fingers, args.seed)
+    report = {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+              "cpus": os.cpu_count(), "results": bench.run()}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+            f.close()
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+            f.close()
+        for name, params, before, after, ratio in compare(baseline["results"], report["results"]):
+            print("{:<32} {:<40} {:>10.6f}s -> {:>10.6f}s  x{:.2f}".format(name, json.dumps(params, sort_keys=True), before, after, ratio), file=sys.stderr)
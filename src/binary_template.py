@@ -1,7 +1,7 @@
 from pair_template import FingerprintTemplate
+from template_store import get_store, user_key
+import instrumentation
 import numpy as np
-import hashlib
-import os
 
 
 class BinaryTemplate(FingerprintTemplate):
@@ -12,6 +12,8 @@ class BinaryTemplate(FingerprintTemplate):
     _length_bits = np.ceil(np.log2(FingerprintTemplate._max_dist//FingerprintTemplate._length_step))  # The number of bits needed to represent the quantized distance between two minutiae points
     _angle_bits = np.ceil(np.log2(2*np.pi//FingerprintTemplate._angle_step))  # The number of bits needed to represent the quantized angle between two minutiae points
 
+    _code_bits = int(_length_bits + 2*_angle_bits + 2)  # The number of bits of a binarized minutiae pair
+
     def __init__(self, username, minutiae_list=None, reference=False):
         '''
             On initialization, the fingerprint template is created from the input features
@@ -19,59 +21,59 @@ class BinaryTemplate(FingerprintTemplate):
             :param minutiae_list: The input features of the fingerprint images
             :param reference: If True, the template is a reference template, else it is a query template
         '''
-        bin_pairs = []
         self._username = username
         self._reference = reference
         if minutiae_list is not None:
             super().__init__(self._username,minutiae_list, self._reference)
-            for mp in self._features:
-                # Get the local feature values
-                L = mp.L
-                a_i = mp.a_i
-                a_j = mp.a_j
-                t_i = mp.t_i
-                t_j = mp.t_j
-                # Convert the local feature values to binary
-                L_bin = np.binary_repr(L, width=int(self._length_bits))
-                a_i_bin = np.binary_repr(a_i, width=int(self._angle_bits))
-                a_j_bin = np.binary_repr(a_j, width=int(self._angle_bits))
-                # Create the binary minutiae pair
-                bin_pairs.append(L_bin + a_i_bin + a_j_bin + str(t_i) + str(t_j))
+            bin_pairs = self.codes_of(self._pair_array)  # Binarize the unique minutiae pairs
+            self._codes = bin_pairs  # Kept when a subclass replaces the features
             self._features = bin_pairs  # Set the binarized minutiae pairs as features
             if self._reference:
                 BinaryTemplate.write_template(username, bin_pairs)  # Save the binarized minutiae pairs to a file (for evaluation purposes)
 
+    @classmethod
+    def codes_of(cls, pairs):
+        '''
+            Binarize unique minutiae pairs, the binary representation of a template
+            :param pairs: An int array with a (L, a_i, a_j, t_i, t_j) row per unique pair
+            :return: The sorted uint32 array of the pair codes
+        '''
+        with instrumentation.timed("binary"):
+            return cls._pair_codes(pairs)
+
+    @classmethod
+    def _pair_codes(cls, pairs):
+        '''
+            Pack quantized minutiae pairs into integer codes
+            The code of a pair is the integer value of the bit string L|a_i|a_j|t_i|t_j
+            :param pairs: An int array with a (L, a_i, a_j, t_i, t_j) row per pair
+            :return: The sorted uint32 array of the pair codes
+        '''
+        angle_bits = int(cls._angle_bits)
+        pairs = pairs.astype(np.uint32)
+        codes = (pairs[:, 0] << (2*angle_bits + 2)) | (pairs[:, 1] << (angle_bits + 2)) | (pairs[:, 2] << 2) | (pairs[:, 3] << 1) | pairs[:, 4]
+        return np.sort(codes)
+
     @staticmethod
     def write_template(username, features):
         '''
-            Write the fingerprint template to a file
+            Write the fingerprint template to the template store, as raw little-endian uint32 pair codes
         '''
 
-        _username = hashlib.sha256(username.encode('utf-8')).hexdigest()  # Hash the username
-        user_path = os.path.join(os.getcwd(), "assets", _username)  # Set the user directory path
-        if not os.path.isdir(user_path):  # Check if the user directory doesn't exist
-            os.mkdir(user_path)
-        with open(os.path.join(user_path, _username + "_binary.dat"), "w") as f:
-            for i in features:
-                f.write(str(i)+"\n")  # Write a binarized minutiae pair per line in the file
-            f.close()
+        get_store().put(user_key(username), "binary", np.asarray(features, dtype='<u4').tobytes())
 
     
     def read_template(self):
         '''
-            Read the fingerprint template from a file
+            Read the fingerprint template from the template store
         '''
 
-        _username = hashlib.sha256(self._username.encode('utf-8')).hexdigest()  # Hash the username
-        user_path = os.path.join(os.getcwd(), "assets", _username)  # Set the user directory path
-        if not os.path.isdir(user_path):  # Check if the user directory doesn't exist
-            raise FileNotFoundError("The user requested does not exist. Please try again.")
-        bin_pairs = []
-        with open(os.path.join(user_path, _username + "_binary.dat"), "r") as f:
-            for line in f:  # Each line contains a binarized minutiae pair
-                line = line.strip()
-                bin_pairs.append(line)
-            f.close()
+        with instrumentation.timed("read.binary"):
+            data = get_store().get(user_key(self._username), "binary")  # Raises FileNotFoundError for unknown users
+            bin_pairs = np.frombuffer(data, dtype='<u4', count=len(data) // 4)
+            if len(data) % 4 or (bin_pairs.size and bin_pairs.max() >> self._code_bits):  # Text template of older versions, a bit string per line
+                lines = bytes(data).decode('utf-8').split()
+                bin_pairs = np.sort(np.array([int(line, 2) for line in lines], dtype=np.uint32))
         self._features = bin_pairs  # Set the binarized minutiae pairs as features
                 
 
@@ -84,10 +86,8 @@ class BinaryTemplate(FingerprintTemplate):
             :return: The similarity score between the two templates
         '''
 
-        matches = 0
         ref_pairs = reference.get_features()  # Get the reference binarized pairs
         query_pairs = query.get_features()  # Get the query binarized pairs
-        for pair in query_pairs:
-            if pair in ref_pairs:  # Count the matching pairs
-                matches += 1
+        with instrumentation.timed("match.binary"):
+            matches = np.intersect1d(ref_pairs, query_pairs, assume_unique=True).size  # Count the matching pairs
         return matches/len(query_pairs)  # The maximum possible matches is the number of pairs in the query template
@@ -0,0 +1,218 @@
+import os
+import json
+import mmap
+import struct
+from contextlib import nullcontext
+from phe import paillier
+
+format_version = 2  # The version of the binary ciphertext format
+_magic = b"HOMT"
+_header = struct.Struct(">4sHIIIi")  # magic, version, n bytes, ciphertext bytes, ciphertext count, shared exponent
+_packing = struct.Struct(">HHI")  # slot bits, slots per ciphertext, vector length (since version 2)
+
+
+def serialize_ciphertexts(pubkey, encrypted, slot_bits=1, slots=1, length=None):
+    '''
+        Serialize encrypted numbers in the binary ciphertext format
+        Layout: header, packing, the public key n, then fixed-width big-endian ciphertexts (all big-endian)
+        :param pubkey: The Paillier public key of the ciphertexts
+        :param encrypted: The list of the EncryptedNumber objects
+        :param slot_bits: The width of a slot of the packed plaintexts in bits
+        :param slots: The number of vector elements per plaintext (1 if not packed)
+        :param length: The length of the encrypted vector (defaults to the number of ciphertexts)
+        :return: The serialized bytes
+    '''
+    exponent = min((c.exponent for c in encrypted), default=0)
+    if any(c.exponent != exponent for c in encrypted):  # The format stores one exponent for all the ciphertexts
+        encrypted = [c.decrease_exponent_to(exponent) for c in encrypted]
+    n_bytes = (pubkey.n.bit_length() + 7) // 8
+    c_bytes = (pubkey.nsquare.bit_length() + 7) // 8
+    length = len(encrypted) if length is None else length
+    return b"".join([_header.pack(_magic, format_version, n_bytes, c_bytes, len(encrypted), exponent),
+                     _packing.pack(slot_bits, slots, length), pubkey.n.to_bytes(n_bytes, "big")] +
+                    [c.ciphertext(be_secure=False).to_bytes(c_bytes, "big") for c in encrypted])  # Already obfuscated on encryption
+
+
+def write_ciphertexts(path, pubkey, encrypted, slot_bits=1, slots=1, length=None):
+    '''
+        Write encrypted numbers to a file in the binary ciphertext format
+        :param path: The path of the file
+        :param pubkey: The Paillier public key of the ciphertexts
+        :param encrypted: The list of the EncryptedNumber objects
+        :param slot_bits: The width of a slot of the packed plaintexts in bits
+        :param slots: The number of vector elements per plaintext (1 if not packed)
+        :param length: The length of the encrypted vector (defaults to the number of ciphertexts)
+    '''
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(serialize_ciphertexts(pubkey, encrypted, slot_bits, slots, length))
+        f.close()
+    os.replace(tmp_path, path)  # Never leave a half written template behind
+
+
+def is_ciphertext_data(data):
+    '''
+        Check if serialized data is in the binary ciphertext format
+        :param data: The serialized template (any object supporting the buffer protocol or slicing)
+        :return: True if the data starts with the format's magic, False otherwise (e.g. legacy JSON templates)
+    '''
+    return bytes(data[:len(_magic)]) == _magic
+
+
+def is_ciphertext_file(path):
+    '''
+        Check if a file is in the binary ciphertext format
+        :param path: The path of the file
+        :return: True if the file starts with the format's magic, False otherwise (e.g. legacy JSON templates)
+    '''
+    with open(path, "rb") as f:
+        magic = f.read(len(_magic))
+        f.close()
+    return is_ciphertext_data(magic)
+
+
+class CiphertextFile:
+    '''
+        A read-only view of a file in the binary ciphertext format, ciphertexts are sliced out of the buffer without copies
+        It is also a sequence of EncryptedNumber objects, built only for the positions that are accessed
+    '''
+
+    def __init__(self, buffer, mapping=None):
+        '''
+            Parse the header of the format
+            :param buffer: The contents of the file (any object supporting the buffer protocol, or a SQLiteBlob of the template store)
+            :param mapping: The mmap object backing the buffer (if memory-mapped)
+        '''
+        try:
+            self._buffer = memoryview(buffer)
+        except TypeError:  # Sliced without a buffer, e.g. the blob of a SQLite row
+            self._buffer = buffer
+        self._mapping = mapping
+        magic, version, n_bytes, c_bytes, count, exponent = _header.unpack(self._buffer[:_header.size])
+        if magic != _magic:
+            raise ValueError("Not a homomorphic template file.")
+        if version > format_version:
+            raise ValueError("Unsupported homomorphic template format version {}.".format(version))
+        self._c_bytes = c_bytes
+        self._count = count
+        self.exponent = exponent
+        key_offset = _header.size
+        self.slot_bits, self.slots, self.length = 1, 1, count  # Version 1 files are not packed
+        if version >= 2:
+            self.slot_bits, self.slots, self.length = _packing.unpack(self._buffer[key_offset:key_offset + _packing.size])
+            key_offset += _packing.size
+        self._data_offset = key_offset + n_bytes
+        if len(self._buffer) < self._data_offset + count * c_bytes:
+            raise ValueError("The homomorphic template file is truncated.")
+        self.pubkey = paillier.PaillierPublicKey(n=int.from_bytes(self._buffer[key_offset:self._data_offset], "big"))
+
+    @classmethod
+    def read(cls, path):
+        '''
+            Load a file in the binary ciphertext format
+            :param path: The path of the file
+            :return: The CiphertextFile
+        '''
+        with open(path, "rb") as f:
+            data = f.read()
+            f.close()
+        return cls(data)
+
+    @classmethod
+    def map(cls, path):
+        '''
+            Memory-map a file in the binary ciphertext format, only the pages of the accessed ciphertexts are read
+            :param path: The path of the file
+            :return: The CiphertextFile
+        '''
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # The mapping stays valid after closing the file
+            f.close()
+        return cls(mapping, mapping)
+
+    def reading(self):
+        '''
+            Keep the buffer ready for a series of random reads (the blob of a SQLite row stays open)
+            :return: A context manager
+        '''
+        return self._buffer.reading() if hasattr(self._buffer, "reading") else nullcontext()
+
+    def close(self):
+        '''
+            Release the buffer (and unmap the file if memory-mapped)
+        '''
+        if isinstance(self._buffer, memoryview):
+            self._buffer.release()
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        return self.encrypted_number(i)
+
+    def __iter__(self):
+        return (self.encrypted_number(i) for i in range(self._count))
+
+    def ciphertext(self, i):
+        '''
+            :param i: The position of the ciphertext
+            :return: The raw ciphertext at position i
+        '''
+        if not 0 <= i < self._count:
+            raise IndexError("Ciphertext index out of range.")
+        start = self._data_offset + i * self._c_bytes
+        return int.from_bytes(self._buffer[start:start + self._c_bytes], "big")
+
+    def encrypted_number(self, i):
+        '''
+            :param i: The position of the ciphertext
+            :return: The EncryptedNumber at position i
+        '''
+        return paillier.EncryptedNumber(self.pubkey, self.ciphertext(i), self.exponent)
+
+    def encrypted_numbers(self):
+        '''
+            :return: The list of all the EncryptedNumber objects
+        '''
+        return [self.encrypted_number(i) for i in range(self._count)]
+
+    def patches(self, updates):
+        '''
+            Encode replacement ciphertexts, to be written over the file in place
+            :param updates: A dictionary position -> EncryptedNumber of the file's public key
+            :return: A list of (byte offset, bytes) tuples
+        '''
+        chunks = []
+        for i, c in sorted(updates.items()):
+            if not 0 <= i < self._count:
+                raise IndexError("Ciphertext index out of range.")
+            if c.exponent != self.exponent:  # The file stores one exponent for all the ciphertexts
+                c = c.decrease_exponent_to(self.exponent)
+            chunks.append((self._data_offset + i * self._c_bytes, c.ciphertext(be_secure=False).to_bytes(self._c_bytes, "big")))
+        return chunks
+
+
+def parse_json_ciphertexts(data):
+    '''
+        Parse a homomorphic template in the JSON format of older versions
+        :param data: The serialized template (str or bytes)
+        :return: The public key and the list of the EncryptedNumber objects
+    '''
+    ser = json.loads(data)  # Load the serialized template
+    pubkey = paillier.PaillierPublicKey(n=int(ser["pubkey"]["n"]))  # Load the public key
+    return pubkey, [paillier.EncryptedNumber(pubkey, int(i[0]), int(i[1])) for i in ser["features"]]
+
+
+def read_json_ciphertexts(path):
+    '''
+        Read a homomorphic template in the JSON format of older versions
+        :param path: The path of the file
+        :return: The public key and the list of the EncryptedNumber objects
+    '''
+    with open(path, "r") as f:
+        data = f.read()
+        f.close()
+    return parse_json_ciphertexts(data)
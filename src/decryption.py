@@ -0,0 +1,118 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from phe import paillier
+import instrumentation
+from encryption import PackedScore
+from keyring_store import default_cache_size
+
+default_processes = os.cpu_count() or 1  # The number of decryption processes
+_batch_size = 256  # The number of ciphertexts per decryption task
+
+_private_keys = OrderedDict()  # n -> PaillierPrivateKey, the per-process LRU cache of the CRT precomputation (hp, hq, p^-1 mod q)
+
+
+def _private_key(n, p, q):
+    '''
+        Get a private key of the per-process cache, creating it on first use
+        The cache is bounded as the cache of a KeyringStore, so a long-running worker does not keep every key it has used
+    '''
+    key = _private_keys.get(n)
+    if key is None:
+        key = _private_keys[n] = paillier.PaillierPrivateKey(paillier.PaillierPublicKey(n), p, q)
+        if len(_private_keys) > default_cache_size:
+            _private_keys.popitem(last=False)
+    else:
+        _private_keys.move_to_end(n)
+    return key
+
+
+def _decrypt_with(key, items):
+    '''
+        Decrypt ciphertexts with a private key, using CRT decryption
+        :param key: The PaillierPrivateKey
+        :param items: A list of (ciphertext, exponent) tuples
+        :return: The list of the decrypted values
+    '''
+    return [paillier.EncodedNumber(key.public_key, key.raw_decrypt(c), e).decode() for c, e in items]
+
+
+def _decrypt_batch(n, p, q, items):
+    '''
+        Decrypt ciphertexts of the same private key in a worker process, the key is rebuilt from its primes
+        :param n: The modulus of the public key
+        :param p: The first prime of the private key
+        :param q: The second prime of the private key
+        :param items: A list of (ciphertext, exponent) tuples
+        :return: The list of the decrypted values
+    '''
+    return _decrypt_with(_private_key(n, p, q), items)
+
+
+class DecryptionService:
+    '''
+        Batch decryption of similarity scores over a private keyring, spread across a process pool
+    '''
+
+    def __init__(self, keyring, processes=None):
+        '''
+            :param keyring: The keyring with the private keys (KeyringStore or PaillierPrivateKeyring)
+            :param processes: The number of processes (defaults to all the cores, 1 decrypts inline)
+        '''
+        self._keyring = keyring
+        self._processes = default_processes if processes is None else processes
+        self._executor = None
+        self._lock = threading.Lock()  # Batches may be submitted from several threads
+
+    def decrypt(self, encrypted_number):
+        '''
+            Decrypt a single encrypted number
+            :param encrypted_number: The EncryptedNumber
+            :return: The decrypted value
+        '''
+        return self.decrypt_many([encrypted_number])[0]
+
+    def decrypt_many(self, encrypted_numbers):
+        '''
+            Decrypt many encrypted numbers, possibly of different public keys
+            :param encrypted_numbers: The EncryptedNumber objects
+            :return: The decrypted values, in the order of the input
+        '''
+        with instrumentation.timed("decrypt"):
+            decrypted = self._decrypt_many(encrypted_numbers)
+        instrumentation.count("ciphertexts.decrypted", len(encrypted_numbers))
+        return decrypted
+
+    def _decrypt_many(self, encrypted_numbers):
+        groups = {}  # public key -> positions of its encrypted numbers
+        for pos, number in enumerate(encrypted_numbers):
+            groups.setdefault(number.public_key, []).append(pos)
+        tasks = []  # (positions, private key, arguments of _decrypt_batch)
+        for pubkey, positions in groups.items():
+            key = self._keyring[pubkey]  # Raises KeyError for an unknown public key
+            for start in range(0, len(positions), _batch_size):
+                chunk = positions[start:start + _batch_size]
+                items = [(encrypted_numbers[i].ciphertext(be_secure=False), encrypted_numbers[i].exponent) for i in chunk]
+                tasks.append((chunk, key, (pubkey.n, key.p, key.q, items)))
+        if self._processes <= 1 or len(tasks) <= 1:  # Inline, with the keys of the keyring
+            results = [_decrypt_with(key, args[3]) for _, key, args in tasks]
+        else:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self._processes)
+            results = self._executor.map(_decrypt_batch, *zip(*(args for _, _, args in tasks)))
+        decrypted = [None] * len(encrypted_numbers)
+        for (chunk, _, _), values in zip(tasks, results):
+            for pos, value in zip(chunk, values):
+                number = encrypted_numbers[pos]
+                decrypted[pos] = number.score(value) if isinstance(number, PackedScore) else value  # Packed scores are a slot of the plaintext
+        return decrypted
+
+    def close(self):
+        '''
+            Stop the process pool
+        '''
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
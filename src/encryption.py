@@ -0,0 +1,207 @@
+import os
+import secrets
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from phe import paillier
+from phe.util import powmod, mulmod
+
+default_processes = os.cpu_count() or 1  # The number of encryption processes
+
+
+def _obfuscators(pubkey, count):
+    '''
+        Compute fresh Paillier obfuscators r^n mod n^2 (the costly part of an encryption)
+        :param pubkey: The Paillier public key
+        :param count: The number of obfuscators
+        :return: The list of the obfuscators
+    '''
+    return [powmod(pubkey.get_random_lt_n(), pubkey.n, pubkey.nsquare) for _ in range(count)]
+
+
+def _chunks(count, parts):
+    '''
+        Split a count into at most parts nearly equal, non-zero parts
+    '''
+    size, rest = divmod(count, parts)
+    return [size + (i < rest) for i in range(parts) if size + (i < rest)]
+
+
+def generate_obfuscators(pubkey, count, processes=None):
+    '''
+        Compute fresh obfuscators, split across processes
+        :param pubkey: The Paillier public key
+        :param count: The number of obfuscators
+        :param processes: The number of processes (defaults to all the cores, 1 runs inline)
+        :return: The list of the obfuscators
+    '''
+    processes = default_processes if processes is None else processes
+    if processes <= 1 or count < 2*processes:
+        return _obfuscators(pubkey, count)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        parts = _chunks(count, 4*processes)  # Smaller chunks even out the load of the processes
+        results = executor.map(_obfuscators, [pubkey]*len(parts), parts)
+        return [r for part in results for r in part]
+
+
+class ObfuscatorPool:
+    '''
+        A pool of precomputed obfuscators r^n mod n^2 of a public key, filled ahead of time or in idle time
+        Every obfuscator is handed out once, reusing one would link the ciphertexts it produced.
+        The obfuscators reveal the plaintexts of the ciphertexts made with them, so they are only kept in memory.
+    '''
+
+    def __init__(self, pubkey):
+        '''
+            Create an empty pool
+            :param pubkey: The Paillier public key of the obfuscators
+        '''
+        self._pubkey = pubkey
+        self._values = deque()
+        self._lock = threading.Lock()
+        self._filler = None
+
+    def get_public_key(self):
+        '''
+            :return: The public key of the obfuscators
+        '''
+        return self._pubkey
+
+    def fill(self, count, processes=None):
+        '''
+            Compute and add obfuscators to the pool
+            :param count: The number of obfuscators to add
+            :param processes: The number of processes to use
+        '''
+        values = generate_obfuscators(self._pubkey, count, processes)
+        with self._lock:
+            self._values.extend(values)
+
+    def fill_in_background(self, target, batch=1024, processes=1):
+        '''
+            Keep filling the pool in a background thread until it holds target obfuscators
+            :param target: The pool size to reach
+            :param batch: The number of obfuscators computed per step
+            :param processes: The number of processes to use per step
+            :return: The filler thread
+        '''
+        def run():
+            while len(self) < target:
+                self.fill(min(batch, target - len(self)), processes)
+        if self._filler is None or not self._filler.is_alive():
+            self._filler = threading.Thread(target=run, daemon=True)
+            self._filler.start()
+        return self._filler
+
+    def take(self, count):
+        '''
+            Remove obfuscators from the pool
+            :param count: The number of obfuscators requested
+            :return: A list of at most count obfuscators
+        '''
+        with self._lock:
+            count = min(count, len(self._values))
+            return [self._values.popleft() for _ in range(count)]
+
+    def __len__(self):
+        return len(self._values)
+
+
+def packing_slots(pubkey, slot_bits, spare_bits=0):
+    '''
+        Get the number of slots of a packed plaintext, so that the product of two packed plaintexts (2*slots-1 slots) is below max_int
+        :param pubkey: The Paillier public key
+        :param slot_bits: The width of a slot in bits
+        :param spare_bits: The bits left free above the product (the room of the mask of a packed score)
+        :return: The number of slots per plaintext
+    '''
+    return max(1, ((pubkey.n.bit_length() - 3 - spare_bits) // slot_bits + 1) // 2)
+
+
+def pack_vector(vector, slot_bits, slots):
+    '''
+        Pack a 0/1 vector into plaintexts, element i goes to the slot i % slots of the plaintext i // slots
+        :param vector: The 0/1 vector
+        :param slot_bits: The width of a slot in bits
+        :param slots: The number of slots per plaintext
+        :return: The list of the packed plaintexts
+    '''
+    packed = [0] * -(-len(vector) // slots)
+    for i in np.flatnonzero(vector).tolist():
+        packed[i // slots] |= 1 << (slot_bits * (i % slots))
+    return packed
+
+
+def score_mask(pubkey, slot_shift, slot_bits, bound, margin_bits):
+    '''
+        Draw a random plaintext that hides every slot of a packed product except the slot of the score:
+        a random multiple of 2^(slot_shift+slot_bits) above it, keeping the sum below max_int, and a random value below it,
+        small enough that it never carries into the score slot
+        Each part is drawn from a range 2^margin_bits times wider than the slots it hides, so the decrypted plaintexts of
+        different references are within 2^-margin_bits statistical distance, besides the score
+        :param pubkey: The Paillier public key
+        :param slot_shift: The bit offset of the score slot
+        :param slot_bits: The width of a slot in bits
+        :param bound: The largest value of a slot of the product (the number of 1's of the query)
+        :param margin_bits: The statistical hiding of the mask in bits
+        :return: The mask plaintext
+    '''
+    slots = slot_shift // slot_bits  # The number of slots below (and above) the score slot
+    hidden = bound * (((1 << (slot_bits * slots)) - 1) // ((1 << slot_bits) - 1))  # The slots below (or above) sum to at most bound*(1 + 2^slot_bits + ...)
+    high_shift = slot_shift + slot_bits
+    low_range = (1 << slot_shift) - hidden
+    high_range = (pubkey.max_int >> high_shift) - hidden
+    if min(low_range, high_range) < hidden << margin_bits:
+        raise ValueError("The packing of the template leaves no room for a {}-bit score mask.".format(margin_bits))
+    return (secrets.randbelow(high_range) << high_shift) + secrets.randbelow(low_range)
+
+
+class PackedScore(paillier.EncryptedNumber):
+    '''
+        An encrypted similarity score of a packed template: the common 1's are a slot of the decrypted plaintext
+    '''
+
+    def __init__(self, public_key, ciphertext, slot_shift, slot_bits, divisor):
+        '''
+            :param public_key: The Paillier public key
+            :param ciphertext: The raw ciphertext
+            :param slot_shift: The bit offset of the slot of the common 1's
+            :param slot_bits: The width of a slot in bits
+            :param divisor: The number of 1's of the query
+        '''
+        super().__init__(public_key, ciphertext, 0)
+        self.slot_shift = slot_shift
+        self.slot_bits = slot_bits
+        self.divisor = divisor
+
+    def score(self, plaintext):
+        '''
+            Recover the similarity score from the decrypted plaintext
+            :param plaintext: The decrypted (integer) plaintext
+            :return: The similarity score
+        '''
+        return ((plaintext >> self.slot_shift) & ((1 << self.slot_bits) - 1)) / self.divisor
+
+
+def encrypt_vector(pubkey, vector, pool=None, processes=None):
+    '''
+        Encrypt a vector of small non-negative integers, equivalent to [pubkey.encrypt(i) for i in vector]
+        Obfuscators are taken from the pool, the missing ones are computed across processes
+        :param pubkey: The Paillier public key
+        :param vector: The integers to encrypt
+        :param pool: An ObfuscatorPool of the public key (optional)
+        :param processes: The number of processes to use
+        :return: The list of the EncryptedNumber objects
+    '''
+    if pool is not None and pool.get_public_key() != pubkey:
+        raise ValueError("The obfuscator pool belongs to a different public key.")
+    obfuscators = pool.take(len(vector)) if pool is not None else []
+    obfuscators += generate_obfuscators(pubkey, len(vector) - len(obfuscators), processes)
+    encrypted = []
+    for value, r in zip(vector, obfuscators):
+        if not 0 <= value <= pubkey.max_int:
+            raise ValueError("Only integers in [0, max_int] can be encrypted by encrypt_vector.")
+        nude_ciphertext = (pubkey.n * int(value) + 1) % pubkey.nsquare  # g^m mod n^2, with g = n+1
+        encrypted.append(paillier.EncryptedNumber(pubkey, mulmod(nude_ciphertext, r, pubkey.nsquare), 0))
+    return encrypted
@@ -0,0 +1,212 @@
+import os
+import time
+import queue
+import logging
+import argparse
+import threading
+import readwrite as rw
+from minutiae import MinutiaPoint
+from homomorphic_template import HomomorphicTemplate
+from index_template import IndexTemplate
+from encryption import ObfuscatorPool
+from extractor import default_workers
+from gallery import IndexGallery, gallery_file_name
+from keypair_pool import KeypairPool, keypair_pool_file_name
+from phe import paillier
+
+logger = logging.getLogger(__name__)
+
+default_queue_size = 4  # The number of users waiting between two stages (an unpacked obfuscator pool is ~50MB for 3072-bit keys)
+_done = object()  # Marks the end of the input of a stage
+
+
+def read_manifest(path):
+    '''
+        Read an enrollment manifest, a "username image_id image_id image_id" line per user (# starts a comment)
+        :param path: The path of the manifest
+        :return: A list of (username, [image ids]) tuples
+    '''
+    entries = []
+    with open(path, "r") as f:
+        for line in f:
+            fields = line.split("#", 1)[0].split()
+            if fields:
+                entries.append((fields[0], fields[1:]))
+        f.close()
+    return entries
+
+
+class _Stage:
+    '''
+        A pipeline stage: worker threads apply a function to the items of the input queue, and put the results to the output queue
+    '''
+
+    def __init__(self, name, func, threads):
+        self.name = name
+        self.func = func
+        self.threads = threads
+        self.done = 0  # The number of users completed
+        self.failed = 0  # The number of users failed
+        self.busy = 0.0  # The seconds spent in func, summed over the threads
+        self._lock = threading.Lock()
+        self._running = threads
+
+    def run(self, inbox, outbox, downstream_threads, on_failure):
+        try:
+            while True:
+                item = inbox.get()
+                if item is _done:
+                    break
+                start = time.perf_counter()
+                try:
+                    result = self.func(item)
+                except Exception as e:
+                    result = None
+                    try:
+                        on_failure(self.name, item, e)
+                    except Exception as cleanup_error:  # A failed cleanup must not stop the stage
+                        logger.error("Cleanup of user {} failed at {}: {}".format(item[0], self.name, cleanup_error))
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.busy += elapsed
+                    if result is None:
+                        self.failed += 1
+                    else:
+                        self.done += 1
+                if result is not None and outbox is not None:
+                    outbox.put(result)
+        finally:  # The next stage always gets its end marks, or it would wait forever
+            with self._lock:
+                self._running -= 1
+                last = self._running == 0
+            if last and outbox is not None:  # Every thread of the next stage gets the end mark
+                for _ in range(downstream_threads):
+                    outbox.put(_done)
+
+
+class EnrollmentPipeline:
+    '''
+        Batch enrollment as a bounded pipeline, the stages of different users overlap:
+        extraction -> keypair -> obfuscators (the costly part of the encryption) -> templates (pairs, index, encryption, storage)
+        Users already enrolled are skipped, so an interrupted or partly failed run is resumed by running it again
+    '''
+
+    def __init__(self, keyring, key_pool=None, gallery=None, extract_threads=default_workers, encryption_processes=None,
+                 queue_size=default_queue_size):
+        '''
+            :param keyring: The keyring to add the private keys to
+            :param key_pool: The KeypairPool to take the keypairs from (optional, keypairs are generated inline without it)
+            :param gallery: The IndexGallery to add the enrolled users to (optional)
+            :param extract_threads: The number of concurrent extractions (at most one per extraction worker is useful)
+            :param encryption_processes: The number of obfuscator processes (defaults to all the cores)
+            :param queue_size: The number of users waiting between two stages
+        '''
+        self._keyring = keyring
+        self._key_pool = key_pool
+        self._gallery = gallery
+        self._encryption_processes = encryption_processes
+        self._queue_size = queue_size
+        self._stages = [_Stage("extract", self._extract, extract_threads),
+                        _Stage("keygen", self._keygen, 1),
+                        _Stage("obfuscate", self._obfuscate, 1),
+                        _Stage("template", self._template, 1)]
+
+    def _extract(self, item):
+        username, images = item
+        if len(images) != 3 or len(set(images)) != 3:
+            raise ValueError("Three different fingerprint images are required.")
+        paths = [rw.get_image_path(img_name) for img_name in images]  # Raises FileNotFoundError for unknown images
+        return username, MinutiaPoint.extract_minutiae_batch(paths)
+
+    def _keygen(self, item):
+        username, minutiae_list = item
+        if self._key_pool is not None:
+            pubk, _ = self._key_pool.generate_keypair(self._keyring)
+        else:
+            pubk, _ = paillier.generate_paillier_keypair(self._keyring)
+        return username, minutiae_list, pubk
+
+    def _obfuscate(self, item):
+        username, minutiae_list, pubk = item
+        obfuscators = ObfuscatorPool(pubk)
+        obfuscators.fill(HomomorphicTemplate.ciphertext_count(pubk), self._encryption_processes)  # One obfuscator per ciphertext
+        return username, minutiae_list, pubk, obfuscators
+
+    def _template(self, item):
+        username, minutiae_list, pubk, obfuscators = item
+        HomomorphicTemplate(username, minutiae_list, True, pubk, obfuscators)  # The templates are stored all or none
+        if self._gallery is not None:
+            index = IndexTemplate(username, reference=True)
+            index.read_template()
+            self._gallery.add(username, index.get_features(), flush=False)
+        return username
+
+    def _on_failure(self, stage, item, error):
+        logger.error("Enrollment of user {} failed at {}: {}".format(item[0], stage, error))
+        if len(item) > 2 and not rw.check_user_existence(item[0]):  # The keypair was taken, but the templates were not stored
+            try:
+                del self._keyring[item[2]]
+            except KeyError:
+                pass
+
+    def run(self, entries):
+        '''
+            Enroll users
+            :param entries: A list of (username, [image ids]) tuples
+            :return: A dictionary stage name -> (completed, failed, users/s, busy seconds)
+        '''
+        unique = {}
+        for username, images in entries:  # A user listed twice is enrolled once, with the images of the first line
+            if username in unique:
+                logger.warning("User {} is listed more than once, only the first entry is enrolled".format(username))
+            else:
+                unique[username] = images
+        entries = list(unique.items())
+        pending = [e for e in entries if not rw.check_user_existence(e[0])]  # Resume: skip the users already enrolled
+        logger.info("{} users to enroll, {} already enrolled".format(len(pending), len(entries) - len(pending)))
+        if self._gallery is not None:  # The gallery of an interrupted run misses the users enrolled after its last flush
+            pending_users = set(e[0] for e in pending)
+            missing = [e[0] for e in entries if e[0] not in pending_users and e[0] not in self._gallery]
+            if missing:
+                logger.info("{} enrolled users added to the gallery".format(self._gallery.add_enrolled(missing)))
+        inbox = queue.Queue()
+        for entry in pending:
+            inbox.put(entry)
+        for _ in range(self._stages[0].threads):
+            inbox.put(_done)
+        queues = [inbox] + [queue.Queue(maxsize=self._queue_size) for _ in self._stages[1:]] + [None]
+        threads = []
+        start = time.perf_counter()
+        for i, stage in enumerate(self._stages):
+            downstream = self._stages[i + 1].threads if i + 1 < len(self._stages) else 0
+            for _ in range(stage.threads):
+                t = threading.Thread(target=stage.run, args=(queues[i], queues[i + 1], downstream, self._on_failure), daemon=True)
+                t.start()
+                threads.append(t)
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        if self._gallery is not None:
+            self._gallery.flush()
+        return {s.name: (s.done, s.failed, s.done / elapsed if elapsed else 0.0, s.busy) for s in self._stages}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch enrollment from a manifest")
+    parser.add_argument("manifest", help="A \"username image_id image_id image_id\" line per user")
+    parser.add_argument("--extract-threads", type=int, default=default_workers)
+    parser.add_argument("--processes", type=int, default=None, help="The number of encryption processes")
+    parser.add_argument("--queue-size", type=int, default=default_queue_size)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    keyring = rw.open_keyring()
+    key_pool = KeypairPool(os.path.join(rw.assets_dir, keypair_pool_file_name))
+    key_pool.fill_in_background()  # Keypairs are generated while the first users are extracted
+    gallery = IndexGallery.open(os.path.join(rw.assets_dir, gallery_file_name))
+    pipeline = EnrollmentPipeline(keyring, key_pool, gallery, args.extract_threads, args.processes, args.queue_size)
+    try:
+        stats = pipeline.run(read_manifest(args.manifest))
+    finally:
+        key_pool.stop()
+    for name, (done, failed, rate, busy) in stats.items():
+        print("{:<10} {:>7} done {:>5} failed {:>9.3f} users/s {:>10.1f}s busy".format(name, done, failed, rate, busy))
@@ -0,0 +1,181 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import readwrite as rw
+from minutiae import MinutiaPoint
+from homomorphic_template import HomomorphicTemplate
+from index_template import IndexTemplate
+from binary_template import BinaryTemplate
+from template_set import TemplateSet
+from decryption import DecryptionService
+import instrumentation
+from phe import paillier
+
+default_processes = os.cpu_count() or 1  # The number of comparison processes
+
+_queries = None  # image name -> TemplateSet of the query templates, set once in every worker
+
+
+def _init_worker(queries):
+    global _queries
+    _queries = queries
+    instrumentation.reset()  # A forked worker starts with a copy of the parent's recordings
+
+
+def _compare_reference(username, comparisons):
+    '''
+        Compare the reference templates of a user with query images (runs in a worker process)
+        :param username: The username of the user
+        :param comparisons: A list of (image name, genuine flag) tuples
+        :return: A list of (image name, encrypted score, index score, binary score, genuine flag) tuples,
+                 and the instrumentation recorded by the worker (None when disabled)
+    '''
+    # Create reference templates
+    ref_hom = HomomorphicTemplate(username, reference=True)
+    ref_hom.read_template(lazy=True)  # Only the ciphertexts at the query's 1's are needed
+    ref_ind = IndexTemplate(username, reference=True)
+    ref_ind.read_template()
+    ref_bin = BinaryTemplate(username, reference=True)
+    ref_bin.read_template()
+    references = {"homomorphic": ref_hom, "index": ref_ind, "binary": ref_bin}
+    results = []
+    for img_name, flag in comparisons:
+        scores = _queries[img_name].match_templates(references)  # Every method on the templates of one query
+        results.append((img_name, scores["homomorphic"], scores["index"], scores["binary"], flag))
+    if not instrumentation.enabled:
+        return results, None
+    snap = instrumentation.snapshot()  # Handed to the parent, which merges it
+    instrumentation.reset()
+    return results, snap
+
+
+class EvaluationEngine:
+    '''
+        Evaluation of the matching methods over the dataset: every image is extracted and templated once,
+        the comparisons of the reference users run in parallel and the progress is checkpointed to resume a sweep
+    '''
+
+    def __init__(self, keyring, logger, checkpoint_path, processes=None, score_store=None, key_pool=None):
+        '''
+            :param keyring: The keyring with the private keys (KeyringStore or PaillierPrivateKeyring) of the users
+            :param logger: The logger of the results, a "user img hom ind bin T/F" line per comparison
+            :param checkpoint_path: The file with the users whose comparisons are completed
+            :param processes: The number of comparison processes (defaults to all the cores)
+            :param score_store: A ScoreStore to also write the scores to, a chunk per user (optional)
+            :param key_pool: A KeypairPool to take the keypairs of the registrations from (optional)
+        '''
+        self._keyring = keyring
+        self._key_pool = key_pool
+        self._score_store = score_store
+        self._logger = logger
+        self._checkpoint_path = checkpoint_path
+        self._processes = default_processes if processes is None else processes
+        self._minutiae = {}  # image name -> minutiae points
+
+    def extract(self, users):
+        '''
+            Extract the minutiae of all the images of the users, once
+            :param users: The ids of the users (the image names are <id>_1 to <id>_8)
+        '''
+        names = []
+        paths = []
+        for username in users:
+            for i in range(1, 9):
+                img_name = "{}_{}".format(username, i)
+                try:
+                    paths.append(rw.get_image_path(img_name))
+                    names.append(img_name)
+                except FileNotFoundError:
+                    self._logger.error("Image {} not found".format(img_name))
+        self._minutiae.update(zip(names, MinutiaPoint.extract_minutiae_batch(paths)))
+
+    def is_registered(self, username):
+        '''
+            :param username: The username of the user
+            :return: True if the user has a homomorphic template whose private key is in the keyring
+        '''
+        if not rw.check_user_existence(username):
+            return False
+        ref = HomomorphicTemplate(username, reference=True)
+        try:
+            ref.read_template(lazy=True)
+        except FileNotFoundError:
+            return False
+        return ref.get_public_key() in self._keyring
+
+    def register(self, users):
+        '''
+            Register the users from their images 1 to 3, skipping the ones already registered
+            :param users: The ids of the users
+        '''
+        registered = []
+        for username in users:
+            if self.is_registered(username):
+                continue
+            self._logger.debug("Registration process for user {} started".format(username))
+            minutiae_list = [self._minutiae[n] for n in ("{}_{}".format(username, i) for i in range(1, 4)) if n in self._minutiae]
+            if not minutiae_list:
+                self._logger.error("No images to register user {}".format(username))
+                continue
+            generate = paillier.generate_paillier_keypair if self._key_pool is None else self._key_pool.generate_keypair
+            pubk, _ = generate(self._keyring)  # Take (or generate) the public and private keys
+            HomomorphicTemplate(username, minutiae_list, True, pubk)  # Generate the template
+            self._logger.debug("User {} template generation completed".format(username))
+            registered.append(username)
+        completed = self._completed()
+        if completed & set(registered):  # Results of earlier runs were computed against the replaced templates
+            self._write_completed(completed - set(registered))
+
+    def _completed(self):
+        if not os.path.isfile(self._checkpoint_path):
+            return set()
+        with open(self._checkpoint_path, "r") as f:
+            completed = set(line.strip() for line in f if line.strip())
+            f.close()
+        return completed
+
+    def _write_completed(self, completed):
+        with open(self._checkpoint_path, "w") as f:
+            f.write("".join(u + "\n" for u in completed))
+            f.close()
+
+    def compare(self, users):
+        '''
+            Compare every user with its images 4 to 8 (genuine) and all the images of the other users (impostor)
+            Users completed in an earlier, interrupted run are skipped
+            :param users: The ids of the users, in the order of the results
+        '''
+        completed = self._completed()
+        pending = [u for u in users if u not in completed and rw.check_user_existence(u)]
+        if not pending:
+            return
+        # Create the query templates of every image once, the pairs of an image are computed once for all the methods
+        queries = {n: TemplateSet(None, m) for n, m in self._minutiae.items()}
+        jobs = []
+        for username in pending:
+            comparisons = [("{}_{}".format(username, i), "T") for i in range(4, 9)]
+            comparisons += [("{}_{}".format(image, i), "F") for image in users if image != username for i in range(1, 9)]
+            jobs.append([c for c in comparisons if c[0] in queries])  # Missing images were reported on extraction
+        decryptor = DecryptionService(self._keyring)
+        with ProcessPoolExecutor(max_workers=self._processes, initializer=_init_worker, initargs=(queries,)) as executor:
+            for username, (results, snap) in zip(pending, executor.map(_compare_reference, pending, jobs)):
+                instrumentation.merge(snap)  # The reads and matches of the worker
+                hom_matches = decryptor.decrypt_many([r[1] for r in results])  # Decrypt the similarity scores
+                for (img_name, _, ind_match, bin_match, flag), hom_match in zip(results, hom_matches):
+                    self._logger.info("{} {} {} {} {} {}".format(username, img_name, hom_match, ind_match, bin_match, flag))
+                if self._score_store is not None:
+                    self._score_store.write_chunk(username, [r[0] for r in results], hom_matches, [r[2] for r in results],
+                                                  [r[3] for r in results], [r[4] == "T" for r in results])
+                with open(self._checkpoint_path, "a") as f:  # The user's results are complete
+                    f.write(username + "\n")
+                    f.close()
+                self._logger.debug("Comparison process for user {} completed".format(username))
+        decryptor.close()
+
+    def run(self, users):
+        '''
+            Run the whole evaluation: extraction, registration and comparisons
+            :param users: The ids of the users
+        '''
+        self.extract(users)
+        self.register(users)
+        self.compare(users)
@@ -0,0 +1,185 @@
+import os
+import struct
+import subprocess
+import threading
+import queue
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+
+jar_path = os.path.join(os.getcwd(), "external", "minutiaeextraction-0.0.1-SNAPSHOT-jar-with-dependencies.jar")  # The SourceAFIS API jar file path
+extractor_version = "sourceafis-3.18.1"  # Bump when the jar changes, it invalidates cached minutiae
+default_workers = min(4, os.cpu_count() or 1)  # The number of warm workers of the shared pool
+
+_KIND_PATH = 0  # The request payload is the path of the image file
+_KIND_IMAGE = 1  # The request payload is the encoded image
+_STATUS_OK = 0  # The response payload is the CBOR SourceAFIS template
+_request_header = struct.Struct(">iBdi")  # id, kind, dpi, payload length
+_response_header = struct.Struct(">iBi")  # id, status, payload length
+
+
+class ExtractionWorker:
+    '''
+        A long-lived SourceAFIS extraction process, speaking the framed protocol of MainClass --worker
+    '''
+
+    def __init__(self, path=None):
+        '''
+            Start the worker process
+            :param path: The path of the jar file (defaults to the one under external/)
+        '''
+        self._path = jar_path if path is None else path
+        self._proc = None
+        self._next_id = 0
+        self.start()
+
+    def start(self):
+        '''
+            Launch the JVM of the worker
+        '''
+        cmd = ["java", "-jar", self._path, "--worker"]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def restart(self):
+        '''
+            Kill the worker process (if still alive) and launch a new one
+        '''
+        self.close()
+        self.start()
+
+    def is_alive(self):
+        '''
+            :return: True if the worker process is running, False otherwise
+        '''
+        return self._proc is not None and self._proc.poll() is None
+
+    def _read_exact(self, size):
+        data = self._proc.stdout.read(size)
+        if len(data) != size:  # The process died while answering
+            raise ConnectionError("The extraction worker exited unexpectedly.")
+        return data
+
+    def request(self, payload, dpi, kind=_KIND_PATH):
+        '''
+            Send an extraction request and wait for its response
+            :param payload: The image path (str) or the encoded image (bytes)
+            :param dpi: The resolution of the image
+            :param kind: The payload kind
+            :return: The CBOR serialized SourceAFIS template
+        '''
+        if self._proc is None:  # A restart failed
+            raise ConnectionError("The extraction worker is not running.")
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        self._next_id = (self._next_id + 1) % 2**31
+        req_id = self._next_id
+        try:
+            self._proc.stdin.write(_request_header.pack(req_id, kind, float(dpi), len(payload)) + payload)
+            self._proc.stdin.flush()
+        except (BrokenPipeError, ValueError) as e:  # ValueError is raised on a closed pipe
+            raise ConnectionError("The extraction worker exited unexpectedly.") from e
+        resp_id, status, length = _response_header.unpack(self._read_exact(_response_header.size))
+        data = self._read_exact(length)
+        if resp_id != req_id:
+            raise ConnectionError("The extraction worker is out of sync.")
+        if status != _STATUS_OK:
+            raise RuntimeError("Minutiae extraction failed: {}".format(data.decode("utf-8", "replace")))
+        return data
+
+    def close(self):
+        '''
+            Stop the worker process
+        '''
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()  # The worker exits on end of input
+            self._proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self._proc.kill()
+            self._proc.wait()
+        self._proc.stdout.close()
+        self._proc = None
+
+
+class ExtractionPool:
+    '''
+        A pool of warm extraction workers that serves requests concurrently
+    '''
+
+    def __init__(self, workers=default_workers, path=None):
+        '''
+            Start the workers of the pool
+            :param workers: The number of worker processes
+            :param path: The path of the jar file (defaults to the one under external/)
+        '''
+        self._workers = [ExtractionWorker(path) for _ in range(workers)]
+        self._idle = queue.Queue()  # The workers that are not serving a request
+        for w in self._workers:
+            self._idle.put(w)
+
+    def extract(self, img_path=None, image=None, dpi=500):
+        '''
+            Extract the SourceAFIS template of a fingerprint image
+            :param img_path: The path to the fingerprint image
+            :param image: The encoded fingerprint image (used instead of img_path)
+            :param dpi: The resolution of the image
+            :return: The CBOR serialized SourceAFIS template
+        '''
+        if image is not None:
+            payload, kind = image, _KIND_IMAGE
+        elif img_path is not None:
+            payload, kind = img_path, _KIND_PATH
+        else:
+            raise ValueError("Either an image path or the image bytes are required.")
+        worker = self._idle.get()  # Wait for a free worker
+        try:
+            if not worker.is_alive():  # Died while idle, or its last restart failed (e.g. java is missing)
+                worker.restart()  # Raises the error of the launch, the worker is restarted again on its next request
+            try:
+                return worker.request(payload, dpi, kind)
+            except ConnectionError:  # The worker died, restart it and retry once
+                worker.restart()
+                return worker.request(payload, dpi, kind)
+        finally:
+            self._idle.put(worker)
+
+    def extract_many(self, img_paths=None, images=None, dpi=500):
+        '''
+            Extract the templates of many fingerprint images, using all the workers concurrently
+            :param img_paths: The paths to the fingerprint images
+            :param images: The encoded fingerprint images (used instead of img_paths)
+            :param dpi: The resolution of the images
+            :return: The CBOR serialized templates, in the order of the input
+        '''
+        if images is not None:
+            job = lambda i: self.extract(image=i, dpi=dpi)
+            items = images
+        else:
+            job = lambda p: self.extract(p, dpi=dpi)
+            items = img_paths
+        with ThreadPoolExecutor(max_workers=len(self._workers)) as executor:
+            return list(executor.map(job, items))
+
+    def close(self):
+        '''
+            Stop all the workers of the pool
+        '''
+        for w in self._workers:
+            w.close()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    '''
+        Get the shared extraction pool, starting it on first use
+        :return: The shared ExtractionPool
+    '''
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ExtractionPool()
+            atexit.register(_default_pool.close)
+    return _default_pool
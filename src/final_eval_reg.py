@@ -4,7 +4,7 @@ import readwrite as rw
 import time
 from minutiae import MinutiaPoint
 from homomorphic_template import HomomorphicTemplate
-from phe import paillier
+from keypair_pool import KeypairPool, keypair_pool_file_name
 
 logpath = os.path.join(os.getcwd(), "log", "final_eval_reg.log")
 logger = logging.getLogger(__name__)
@@ -17,11 +17,12 @@ stream_handler = logging.StreamHandler()
 logger.addHandler(file_handler)
 logger.addHandler(stream_handler)
 
-def register_user(username, keyring):
+def register_user(username, keyring, key_pool):
     '''
         Perform the registration process for a user
         :param username: The username of the user
         :param keyring: The paillier keyring to keep the private keys
+        :param key_pool: The KeypairPool to take the paillier keypair from
     '''
     logger.debug("Registration process for user {} started".format(username))
     minutiae_list = []  # A list to store the minutiae points of the fingerprint images
@@ -37,7 +38,7 @@ def register_user(username, keyring):
         img_minutiae = MinutiaPoint.extract_minutiae(img_path)
         minutiae_list.append(img_minutiae)  # Save the minutiae points
         logger.debug("Img {} processed successfully!".format(img_name))
-    pubk,_ = paillier.generate_paillier_keypair(keyring)  # Generate the paillier keypair
+    pubk,_ = key_pool.generate_keypair(keyring)  # Take (or generate) the paillier keypair
     template = HomomorphicTemplate(username, minutiae_list, True, pubk)  # Generate the template
     reg_time = time.perf_counter() - reg_time  # Calculate the registration time
     logger.info("Registration time: {}".format(reg_time))
@@ -45,13 +46,10 @@ def register_user(username, keyring):
 
 if __name__ == "__main__":
     
-    if not rw.check_keyring_existence():
-        keyring = paillier.PaillierPrivateKeyring()
-    else:
-        keyring = rw.load_keyring()
+    keyring = rw.open_keyring()
+    key_pool = KeypairPool(os.path.join(rw.assets_dir, keypair_pool_file_name))
 
     images = ['045_7','017_3','012_5','076_8']
     for image in images:
         logger.info(image)
-        register_user(image, None)
-    rw.save_keyring(keyring)
\ No newline at end of file
+        register_user(image, keyring, key_pool)
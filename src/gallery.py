@@ -0,0 +1,199 @@
+import os
+import json
+import heapq
+import threading
+import numpy as np
+from index_template import IndexTemplate
+from template_store import get_store, user_key
+from utils import popcount, popcount_rows
+
+gallery_file_name = "gallery.dat"  # The name of the gallery file under assets/
+_block_rows = 4096  # The number of rows scored at once
+
+
+class IndexGallery:
+    '''
+        A 1:N identification gallery, holding the packed indexes of the enrolled users as the rows of one bit matrix
+        The matrix is kept in memory, or memory-mapped from a file (with the usernames in a .users JSON file next to it)
+        It is safe to use from many threads: additions and removals (which may remap the file) never overlap a scoring
+    '''
+
+    def __init__(self, path=None):
+        '''
+            Create an empty gallery, or open the gallery file (if it exists)
+            :param path: The path of the gallery file (None for an in-memory gallery)
+        '''
+        self._path = path
+        self._lock = threading.RLock()  # Guards the rows and the usernames
+        self._users = []  # The username of every row (None for a free row)
+        self._rows = np.zeros((0, IndexTemplate._index_words), dtype='<u8')
+        if path is not None and os.path.isfile(path + ".users"):
+            with open(path + ".users", "r") as f:
+                self._users = json.load(f)
+                f.close()
+        if self._users:
+            self._rows = np.memmap(path, dtype='<u8', mode='r+', shape=(len(self._users), IndexTemplate._index_words))
+        self._positions = {u: i for i, u in enumerate(self._users) if u is not None}  # username -> row
+        self._free = [i for i, u in enumerate(self._users) if u is None]  # The free rows, a heap (sorted already)
+
+    @classmethod
+    def build(cls, usernames, path=None):
+        '''
+            Build a gallery from the index templates of enrolled users
+            :param usernames: The usernames of the users (the ones without an index template are skipped)
+            :param path: The path of the gallery file (None for an in-memory gallery)
+            :return: The IndexGallery
+        '''
+        gallery = cls(path)
+        gallery.add_enrolled(usernames)
+        return gallery
+
+    @classmethod
+    def build_from_store(cls, path=None):
+        '''
+            Build a gallery from the index templates of all the users of the template store
+            Users are named by the username of their metadata, or by their user key if enrolled before it was recorded
+            :param path: The path of the gallery file (None for an in-memory gallery)
+            :return: The IndexGallery
+        '''
+        gallery = cls(path)
+        store = get_store()
+        users = store.users()
+        names = {}
+        for key, data in store.get_many(users, "meta").items():
+            names[key] = json.loads(data).get("username") or key
+        for key, data in store.get_many(users, "index").items():  # Bulk read of the index templates
+            gallery.add(names.get(key, key), IndexTemplate.parse_index(data), flush=False)
+        gallery.flush()
+        return gallery
+
+    @classmethod
+    def open(cls, path):
+        '''
+            Open a gallery file, or build it from the template store if it is missing (e.g. users enrolled before the gallery existed)
+            :param path: The path of the gallery file
+            :return: The IndexGallery
+        '''
+        if os.path.isfile(path + ".users"):
+            return cls(path)
+        return cls.build_from_store(path)
+
+    def add_enrolled(self, usernames):
+        '''
+            Add (or replace) enrolled users from their index templates in the template store
+            :param usernames: The usernames of the users (the ones without an index template are skipped)
+            :return: The number of users added
+        '''
+        keys = {user_key(u): u for u in usernames}
+        found = get_store().get_many(keys, "index")  # Bulk read of the index templates
+        for key, data in found.items():
+            self.add(keys[key], IndexTemplate.parse_index(data), flush=False)
+        self.flush()
+        return len(found)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, username):
+        return username in self._positions
+
+    def _grow(self):
+        '''
+            Double the capacity of the matrix (at least one row), the new rows are free
+        '''
+        capacity = len(self._users)
+        new_capacity = max(1, 2*capacity)
+        if self._path is None:
+            rows = np.zeros((new_capacity, IndexTemplate._index_words), dtype='<u8')
+            rows[:capacity] = self._rows
+            self._rows = rows
+        else:
+            if isinstance(self._rows, np.memmap):
+                self._rows.flush()
+            self._rows = None  # Unmap before resizing the file
+            with open(self._path, "ab") as f:
+                f.truncate(new_capacity * IndexTemplate._index_words * 8)  # The new rows are zero filled
+                f.close()
+            self._rows = np.memmap(self._path, dtype='<u8', mode='r+', shape=(new_capacity, IndexTemplate._index_words))
+        self._users.extend([None] * (new_capacity - capacity))
+        for row in range(capacity, new_capacity):
+            heapq.heappush(self._free, row)
+
+    def add(self, username, index, flush=True):
+        '''
+            Add (or replace) the index of a user
+            :param username: The username of the user
+            :param index: The packed index of the user's reference template
+            :param flush: If True, the gallery file is updated right away
+        '''
+        with self._lock:
+            row = self._positions.get(username)
+            if row is None:
+                if not self._free:
+                    self._grow()
+                row = heapq.heappop(self._free)  # Reuse the first free row
+                self._users[row] = username
+                self._positions[username] = row
+            self._rows[row] = index
+            if flush:
+                self.flush()
+
+    def remove(self, username, flush=True):
+        '''
+            Remove a user from the gallery, the row is cleared and reused by later additions
+            :param username: The username of the user
+            :param flush: If True, the gallery file is updated right away
+        '''
+        with self._lock:
+            row = self._positions.pop(username)  # Raises KeyError for a user not in the gallery
+            self._rows[row] = 0
+            self._users[row] = None
+            heapq.heappush(self._free, row)
+            if flush:
+                self.flush()
+
+    def scores(self, query_index):
+        '''
+            Score a query against every row of the gallery, as IndexTemplate.match_templates does
+            :param query_index: The packed index of the query
+            :return: The float array of the scores of the rows (-1 for free rows)
+        '''
+        query_ones = popcount(query_index)
+        with self._lock:
+            scores = np.empty(len(self._users))
+            for start in range(0, len(self._users), _block_rows):
+                block = self._rows[start:start + _block_rows]
+                scores[start:start + len(block)] = popcount_rows(np.bitwise_and(block, query_index)) / query_ones
+            scores[np.array([u is None for u in self._users], dtype=bool)] = -1
+        return scores
+
+    def identify(self, query_index, k=5):
+        '''
+            Find the enrolled users that best match a query
+            :param query_index: The packed index of the query
+            :param k: The number of candidates
+            :return: A list of (username, score) tuples, best first
+        '''
+        with self._lock:  # The rows keep their users until the candidates are named
+            scores = self.scores(query_index)
+            k = min(k, len(self._positions))
+            if k == 0:
+                return []
+            best = np.argpartition(-scores, k - 1)[:k]  # The k best rows, unordered
+            best = best[np.argsort(-scores[best], kind='stable')]
+            return [(self._users[row], float(scores[row])) for row in best]
+
+    def flush(self):
+        '''
+            Write the gallery to its file (no-op for an in-memory gallery)
+        '''
+        if self._path is None:
+            return
+        with self._lock:
+            if isinstance(self._rows, np.memmap):
+                self._rows.flush()
+            tmp_path = self._path + ".users.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._users, f)
+                f.close()
+            os.replace(tmp_path, self._path + ".users")
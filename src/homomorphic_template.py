@@ -1,10 +1,18 @@
+from pair_template import FingerprintTemplate
+from binary_template import BinaryTemplate
 from index_template import IndexTemplate
-from utils import generate_uniform_matrix, encrypted_xor
+from utils import uniform_matrix_rows, encrypted_xor
+from encryption import encrypt_vector, packing_slots, pack_vector, score_mask, PackedScore
+from ciphertext_file import CiphertextFile, serialize_ciphertexts, is_ciphertext_data, parse_json_ciphertexts
+from template_store import get_store, user_key
+import instrumentation
 import numpy as np
-import hashlib
+import mmap
 import json
-import os
+import time
+from contextlib import nullcontext
 from phe import paillier
+from phe.util import powmod
 
 
 class HomomorphicTemplate(IndexTemplate):
@@ -13,94 +21,320 @@ class HomomorphicTemplate(IndexTemplate):
         Following the paper "Secure Fingerprint Authentication with Homomorphic Encryption" by
         Yang et al. (https://doi.org/10.1109/DICTA51227.2020.9363426)
     '''
-    _vector_size = 600  # The size of the reduced vector (Not used in this implementation)
+    _vector_size = 600  # The size of the reduced vector
+    _reduced = False  # If True, the index vector is reduced to _vector_size bits by a random projection seeded by the username
+    _encryption_processes = None  # The number of encryption processes (None uses all the cores)
+    _packed = True  # If True, many index positions are packed in the slots of one plaintext
+    _mask_bits = 40  # The statistical hiding of the mask of a packed score, the bits kept free above a packed product
+    _slot_bits = IndexTemplate._index_factor.bit_length() + _mask_bits + 1  # The width of a slot: sums over all the positions, the margin of the score mask below the score slot and a guard bit
 
-    def __init__(self,username,minutiae_list=None, reference = False, pubkey = None):
+    def __init__(self,username,minutiae_list=None, reference = False, pubkey = None, obfuscators = None):
         '''
             On initialization, the fingerprint template is created from the input features
             :param username: The username of the user
             :param minutiae_list: The input features of the fingerprint images
             :param reference: If True, the template is a reference template, else it is a query template
             :param pubkey: The public key of the Pailler cryptosystem (only used for reference templates)
+            :param obfuscators: An ObfuscatorPool of the public key to speed up the encryption (optional)
         '''
         self._username = username
         self._reference = reference
+        self._obfuscators = obfuscators
+        self._slots = 1  # The number of index positions per plaintext
+        self._length = self._vector_size if self._reduced else self._index_factor  # The length of the encrypted vector
         if minutiae_list is not None:  # If the minutiae list is not provided, then the template remains empty to be read from a file
-            super().__init__(self._username, minutiae_list, self._reference)  # Call the parent class constructor
+            if self._reference and pubkey is None:  # If the public key is not provided
+                raise ValueError("Public key is required for reference templates.")
+            super().__init__(self._username, minutiae_list)  # Build the pairs, codes and index as a query, nothing is stored yet
+            self._reference = reference
             if self._reference:  # If the template is a reference template
-                if pubkey is None:  # If the public key is not provided
-                    raise ValueError("Public key is required for reference templates.")
-                self._pubkey = pubkey
-                self._encrypt_features()  # Perform the encryption of the vector
-                self.write_template()  # Write the template to a file
+                index = self._features
+                self._encrypt_index(index, pubkey)  # Perform the encryption of the index, before the store is locked
+                with get_store().transaction():  # The raw, binary, index and homomorphic templates are stored all or none
+                    FingerprintTemplate.write_template(self._username, self._pair_array)
+                    BinaryTemplate.write_template(self._username, self._codes)
+                    IndexTemplate.write_template(self._username, index)
+                    self.write_template()  # Write the template to the store
+                    self.write_metadata(self._username, {"version": 1, "username": self._username, "created": time.time(), "updates": []})
         else:
             self._features = None
     
 
-    def _reduce_features(self):
+    def get_public_key(self):
         '''
-            Reduce the dimension of the index vector (Not used in this implementation)
+            Get the Paillier public key of the template (reference templates only)
+            :return: The public key
         '''
-        _username = hashlib.sha256(self._username.encode('utf-8')).hexdigest()  # Hash the username
-        seed = int(_username, 16) % (2**32-1)  # Generate a seed from the username
-        mat = generate_uniform_matrix(self._index_factor, HomomorphicTemplate._vector_size, seed)  # Generate a random matrix
-        self._features = np.dot(self._features, mat)  # Reduce the dimension of the index vector
-        self._features = (self._features > 0).astype(int)  # Binarize the index vector
+        return self._pubkey
+
+
+    @classmethod
+    def ciphertext_count(cls, pubkey):
+        '''
+            Get the number of ciphertexts of a reference template
+            :param pubkey: The public key of the template
+            :return: The number of ciphertexts
+        '''
+        length = cls._vector_size if cls._reduced else cls._index_factor
+        if not cls._packed:
+            return length
+        return -(-length // packing_slots(pubkey, cls._slot_bits, cls._mask_bits))
+
+
+    @classmethod
+    def reduce_positions(cls, username, positions, size=None):
+        '''
+            Reduce an index by the random projection of a user: the binarized product with a seeded _index_factor x size uniform matrix
+            Only the matrix rows at the index's 1's are generated, so the 65,535 x size matrix is never built
+            :param username: The username of the user (the seed of the projection)
+            :param positions: The positions of the 1's of the index
+            :param size: The size of the reduced vector (defaults to _vector_size)
+            :return: The positions of the 1's of the reduced vector
+        '''
+        size = cls._vector_size if size is None else size
+        seed = int(user_key(username), 16) % (2**32-1)  # Generate a seed from the username
+        projected = uniform_matrix_rows(positions, size, seed).sum(axis=0)  # The product of the 0/1 index with the matrix
+        return np.flatnonzero(projected > 0)  # Binarize the reduced vector
+
+
+    @classmethod
+    def plain_vector(cls, username, index, length):
+        '''
+            Get the plaintext vector encrypted by a reference template
+            :param username: The username of the user (the seed of the projection of reduced templates)
+            :param index: The packed index of the user
+            :param length: The length of the encrypted vector (_index_factor if not reduced)
+            :return: The vector as a 0/1 uint8 array
+        '''
+        if length == cls._index_factor:
+            return cls.unpack_index(index)
+        vector = np.zeros(length, dtype=np.uint8)
+        vector[cls.reduce_positions(username, cls.index_positions(index), length)] = 1
+        return vector
+
+
+    def _query_positions(self, query):
+        '''
+            Get the positions of the query's 1's in the encrypted vector of this reference template
+            :param query: The query fingerprint template (packed plaintext index)
+            :return: The positions, reduced by the projection of the reference's user if the reference is reduced
+        '''
+        positions = query.index_positions(query.get_features())
+        if self._length != self._index_factor:
+            positions = self.reduce_positions(self._username, positions, self._length)
+        return positions
+
+
+    def _encrypt_index(self, index, pubkey):
+        '''
+            Encrypt a packed index as the features of the template
+            :param index: The packed index
+            :param pubkey: The public key of the Pailler cryptosystem
+        '''
+        self._pubkey = pubkey
+        self._features = self.plain_vector(self._username, index, self._length).tolist()  # The vector to encrypt
+        self._encrypt_features()
 
 
     def _encrypt_features(self):
         '''
             Encrypt the index vector
         '''
-        self._features = [self._pubkey.encrypt(i) for i in self._features]  # Encrypt the index vector
+        if self._packed:  # Position i goes to the slot i % slots of the plaintext i // slots
+            self._slots = packing_slots(self._pubkey, self._slot_bits, self._mask_bits)
+            self._features = pack_vector(self._features, self._slot_bits, self._slots)
+        with instrumentation.timed("encrypt"):
+            self._features = encrypt_vector(self._pubkey, self._features, self._obfuscators, self._encryption_processes)  # Encrypt the index vector across processes
+        instrumentation.count("ciphertexts.encrypted", len(self._features))
 
 
     def write_template(self):
         '''
-            Write the serialized homomorphic template to a file
+            Write the serialized homomorphic template to the template store, in the binary ciphertext format
         '''
-        _username = hashlib.sha256(self._username.encode('utf-8')).hexdigest()  # Hash the username
-        user_path = os.path.join(os.getcwd(), "assets", _username)  # Set the user directory path
-        if not os.path.isdir(user_path):  # Check if the user directory doesn't exist
-            os.mkdir(user_path)
         if self._reference:  # If the template is a reference template
             # Save the public key and the encrypted vector to the template
-            ser = {}
-            ser["pubkey"] = {'n':self._pubkey.n}
-            ser["features"] = [(str(i.ciphertext()), i.exponent) for i in self._features]
-
-        with open(os.path.join(user_path, _username + "_homomorphic.dat"), "w") as f:
-            json.dump(ser, f)
-            f.close()
+            data = serialize_ciphertexts(self._pubkey, self._features, self._slot_bits, self._slots, self._length)
+            get_store().put(user_key(self._username), "homomorphic", data)
     
 
-    def read_template(self):
+    def read_template(self, lazy=False):
         '''
-            Read the serialized homomorphic template from a file
+            Read the serialized homomorphic template from the template store
+            :param lazy: If True, the template is memory-mapped (if the store allows it) and the encrypted numbers are built only for the positions accessed
         '''
-        _username = hashlib.sha256(self._username.encode('utf-8')).hexdigest()  # Hash the username
-        user_path = os.path.join(os.getcwd(), "assets", _username)  # Set the user directory path
-        if not os.path.isdir(user_path):  # Check if the user directory doesn't exist
-            raise FileNotFoundError("The user does not exist.")
-        with open(os.path.join(user_path, _username + "_homomorphic.dat"), "r") as f:
-            ser = json.load(f)  # Load the serialized template
-            f.close()
-        self._pubkey = paillier.PaillierPublicKey(n=int(ser["pubkey"]["n"]))  # Load the public key
-        # Load the encrypted vector
-        self._features = [
-            paillier.EncryptedNumber(self._pubkey, int(i[0]), int(i[1])) for i in ser["features"]
-        ]
+        with instrumentation.timed("read.homomorphic"):
+            store = get_store()
+            _username = user_key(self._username)  # Hash the username
+            data = store.map(_username, "homomorphic") if lazy else store.get(_username, "homomorphic")  # Raises FileNotFoundError for unknown users
+            if is_ciphertext_data(data):
+                template = CiphertextFile(data, data if isinstance(data, mmap.mmap) else None)
+                if lazy:
+                    self._features = template  # Random-access sequence of the encrypted vector
+                else:
+                    self._features = template.encrypted_numbers()  # Load the encrypted vector
+                self._pubkey = template.pubkey  # Load the public key
+                self._slots = template.slots
+                self._slot_bits = template.slot_bits
+                self._length = template.length
+            else:  # JSON template of older versions
+                self._pubkey, self._features = parse_json_ciphertexts(bytes(data))
+                self._slots = 1
+                self._length = len(self._features)
+
+
+    @staticmethod
+    def read_metadata(username):
+        '''
+            Read the version metadata of the templates of a user
+            :param username: The username of the user
+            :return: A dictionary: {"version": int, "username": str, "created": timestamp, "updates": [{"time", "pairs_added", "ciphertexts_changed"}]}
+        '''
+        try:
+            return json.loads(get_store().get(user_key(username), "meta"))
+        except FileNotFoundError:  # Templates of older versions have no metadata
+            return {"version": 1, "username": username, "created": None, "updates": []}
+
+
+    @staticmethod
+    def write_metadata(username, meta):
+        '''
+            Write the version metadata of the templates of a user to the template store, as JSON
+            :param username: The username of the user
+            :param meta: The metadata dictionary
+        '''
+        get_store().put(user_key(username), "meta", json.dumps(meta).encode('utf-8'))
+
+
+    @classmethod
+    def update_template(cls, username, minutiae):
+        '''
+            Add a fingerprint image to the templates of an enrolled user, without a full re-enrollment
+            The raw, binary and index templates become those of an enrollment with the added image, and only the
+            ciphertexts whose plaintext changed are re-encrypted and written over the homomorphic template in place
+            :param username: The username of the user
+            :param minutiae: The list of MinutiaPoint objects of the added image
+            :return: The number of re-encrypted ciphertexts
+        '''
+        store = get_store()
+        _username = user_key(username)  # Hash the username
+        added = cls._quantized_pairs(minutiae)
+        with instrumentation.timed("update"):
+            while True:  # Computed and encrypted without the store's lock, retried if another update was written meanwhile
+                meta = cls.read_metadata(username)
+                raw = FingerprintTemplate(username, reference=True)
+                raw.read_template()  # Raises FileNotFoundError for unknown users
+                index = IndexTemplate(username, reference=True)
+                index.read_template()
+                # The unique pairs of the enrollment, followed by the new pairs of the added image
+                pairs = np.concatenate([raw.get_features(), added])
+                _, first = np.unique(cls._pair_keys(pairs), return_index=True)
+                pairs = pairs[np.sort(first)]
+                codes = cls.codes_of(pairs)
+                new_index = cls.index_of(codes)
+                data = store.get(_username, "homomorphic")
+                if is_ciphertext_data(data):
+                    template = CiphertextFile(data)
+                    pubkey, slot_bits, slots, length = template.pubkey, template.slot_bits, template.slots, template.length
+                else:  # JSON template of older versions
+                    template = None
+                    pubkey, encrypted = parse_json_ciphertexts(bytes(data))
+                    slot_bits, slots, length = 1, 1, len(encrypted)
+                new_vector = cls.plain_vector(username, new_index, length)
+                changed = np.unique(np.flatnonzero(cls.plain_vector(username, index.get_features(), length) != new_vector) // slots)
+                plaintexts = pack_vector(new_vector, slot_bits, slots) if slots > 1 else new_vector.tolist()
+                with instrumentation.timed("encrypt"):  # Only the changed ciphertexts
+                    updates = dict(zip(changed.tolist(), encrypt_vector(pubkey, [plaintexts[i] for i in changed.tolist()],
+                                                                        processes=cls._encryption_processes)))
+                instrumentation.count("ciphertexts.encrypted", len(updates))
+                with store.transaction():  # The templates and the metadata are updated all or none
+                    if cls.read_metadata(username) != meta:  # Updated or re-enrolled since it was read
+                        continue
+                    meta["version"] += 1
+                    meta["updates"].append({"time": time.time(), "pairs_added": len(pairs) - len(raw.get_features()),
+                                            "ciphertexts_changed": len(updates)})
+                    FingerprintTemplate.write_template(username, pairs)
+                    BinaryTemplate.write_template(username, codes)
+                    IndexTemplate.write_template(username, new_index)
+                    if template is not None:
+                        store.patch(_username, "homomorphic", template.patches(updates))  # Only the changed ciphertexts are written
+                    else:  # Rewritten in the binary ciphertext format
+                        for i, c in updates.items():
+                            encrypted[i] = c
+                        store.put(_username, "homomorphic", serialize_ciphertexts(pubkey, encrypted))
+                    cls.write_metadata(username, meta)
+                    break
+        return len(updates)
 
 
     @staticmethod
     def match_templates(reference, query):
         '''
             Match two fingerprint templates using their indexes
-            :param reference: The reference fingerprint template
-            :param query: The query fingerprint template
+            Multiplying the reference ciphertexts by the query bits only keeps those at the query's 1's,
+            so the sum is formed by adding just these ciphertexts (same ciphertext as the full product sum)
+            :param reference: The reference fingerprint template (encrypted index)
+            :param query: The query fingerprint template (packed plaintext index)
             :return: The encrypted similarity score
         '''
-        ref_features = reference.get_features()  # Get the reference features
-        query_features = query.get_features()  # Get the query features
-        common_ones = [ref_features[i]*query_features[i] for i in range(len(ref_features))]  # Compute the common ones
-        return sum(common_ones)/sum(query_features)  # Return the similarity score
\ No newline at end of file
+        if reference._slots > 1:
+            return HomomorphicTemplate._match_packed(reference, query)
+        with instrumentation.timed("match.homomorphic"):
+            ref_features = reference.get_features()  # Get the reference features
+            positions = reference._query_positions(query)  # Get the positions of the query's 1's
+            with ref_features.reading() if isinstance(ref_features, CiphertextFile) else nullcontext():
+                selected = [ref_features[i] for i in positions]  # The reference ciphertexts at the query's 1's
+            if len(set(c.exponent for c in selected)) == 1:  # Add the raw ciphertexts, no exponent alignment needed
+                pubkey = selected[0].public_key
+                ciphertext = 1
+                for c in selected:
+                    ciphertext = ciphertext * c.ciphertext(be_secure=False) % pubkey.nsquare  # Homomorphic addition
+                common_ones = paillier.EncryptedNumber(pubkey, ciphertext, selected[0].exponent)
+            else:
+                common_ones = sum(selected)
+            score = common_ones/len(positions)  # The similarity score
+        instrumentation.count("ciphertexts.added", len(selected))
+        return score
+
+
+    @staticmethod
+    def _match_packed(reference, query):
+        '''
+            Match a packed reference template with a query template
+            Every reference plaintext is multiplied by the query bits of its positions packed in reverse slot order, so the
+            product's middle slot is the number of common 1's. The sum of the products is formed with one shared
+            square-and-multiply over the slots: the ciphertexts of the query's 1's at a slot are multiplied in, then shifted a slot up.
+            A random mask is added, so the decrypted plaintext reveals only the middle slot.
+            :param reference: The reference fingerprint template (packed encrypted index)
+            :param query: The query fingerprint template (packed plaintext index)
+            :return: The encrypted similarity score (a PackedScore, the score is recovered on decryption)
+        '''
+        with instrumentation.timed("match.homomorphic"):
+            ref_features = reference.get_features()  # Get the reference features
+            pubkey = reference.get_public_key()
+            slots = reference._slots
+            slot_bits = reference._slot_bits
+            positions = reference._query_positions(query)  # Get the positions of the query's 1's
+            by_slot = [[] for _ in range(slots)]  # slot -> plaintexts with a query 1 at that slot
+            for p in positions.tolist():
+                by_slot[p % slots].append(p // slots)
+            if isinstance(ref_features, CiphertextFile):
+                ciphertext = ref_features.ciphertext  # Only the accessed ciphertexts are read
+                reading = ref_features.reading()
+            else:
+                ciphertext = lambda i: ref_features[i].ciphertext(be_secure=False)
+                reading = nullcontext()
+            product = 1
+            with reading:
+                for blocks in by_slot:  # The query bit of slot s multiplies the plaintext by 2^(slot_bits*(slots-1-s))
+                    if product != 1:
+                        product = powmod(product, 1 << slot_bits, pubkey.nsquare)  # Shift the sum a slot up
+                    for i in blocks:
+                        product = product * ciphertext(i) % pubkey.nsquare  # Homomorphic addition
+            # Hide the other slots, they hold the reference bits correlated with shifted copies of the query
+            # Raises ValueError for templates packed by older versions, their slots are too narrow for the mask
+            mask = score_mask(pubkey, slot_bits*(slots - 1), slot_bits, len(positions), HomomorphicTemplate._mask_bits)
+            product = product * pubkey.raw_encrypt(mask) % pubkey.nsquare
+            score = PackedScore(pubkey, product, slot_bits*(slots - 1), slot_bits, len(positions))
+        instrumentation.count("ciphertexts.added", len(positions))
+        return score
@@ -1,7 +1,8 @@
 from binary_template import BinaryTemplate
+from utils import popcount
+from template_store import get_store, user_key
+import instrumentation
 import numpy as np
-import hashlib
-import os
 
 
 class IndexTemplate(BinaryTemplate):
@@ -11,6 +12,7 @@ class IndexTemplate(BinaryTemplate):
     '''
 
     _index_factor = 2**16 - 1  # The number of bits needed to represent the index of the binary minutiae pairs
+    _index_words = int(np.ceil(_index_factor / 64))  # The number of uint64 words of the packed index
 
     def __init__(self, username, minutiae_list=None, reference=False):
         '''
@@ -23,50 +25,91 @@ class IndexTemplate(BinaryTemplate):
         self._reference = reference
         if minutiae_list is not None:  # If the minutiae list is not provided, then the template remains empty to be read from a file
             super().__init__(self._username, minutiae_list, self._reference)  # Call the parent class constructor
-            index = [0 for i in range(self._index_factor)]  # Initialize the index
-            # Perform the hashing of the binary minutiae pairs to generate the index
-            for mp in self._features:
-                a = int(mp, 2)
-                idx = np.mod(a, self._index_factor)
-                index[idx] = 1
-            self._features = index  # Set the index vector as the features
+            index = self.index_of(self._features)  # Perform the hashing of the binary minutiae pairs to generate the index
+            self._features = index  # Set the packed index as the features
             if self._reference:
                 IndexTemplate.write_template(self._username, index)  # Save the index to a file (for evaluation purposes)
         else:
             self._features = None
 
     
+    @classmethod
+    def index_of(cls, codes):
+        '''
+            Hash binary minutiae pairs to the index, the index representation of a template
+            :param codes: The pair codes
+            :return: The packed index
+        '''
+        with instrumentation.timed("index"):
+            index = cls.pack_index(np.mod(codes, cls._index_factor))
+        if instrumentation.enabled:  # Only count the 1's when they are recorded
+            instrumentation.count("index.popcount", popcount(index))
+        return index
+
+
+    @classmethod
+    def pack_index(cls, positions):
+        '''
+            Pack the set positions of an index into a bitset
+            :param positions: The positions of the 1's of the index
+            :return: The index as a uint64 array (bit p of the index is bit p%64 of word p//64)
+        '''
+        bits = np.zeros(cls._index_words * 64, dtype=np.uint8)
+        bits[positions] = 1
+        return np.packbits(bits, bitorder='little').view('<u8')
+
+
+    @classmethod
+    def unpack_index(cls, index):
+        '''
+            Unpack a bitset to the index vector
+            :param index: The packed index
+            :return: The index as a 0/1 uint8 array of _index_factor elements
+        '''
+        return np.unpackbits(index.view(np.uint8), bitorder='little')[:cls._index_factor]
+
+
+    @classmethod
+    def index_positions(cls, index):
+        '''
+            Get the set positions of a packed index
+            :param index: The packed index
+            :return: The positions of the 1's, in increasing order
+        '''
+        return np.flatnonzero(cls.unpack_index(index))
+
+
+    @classmethod
+    def parse_index(cls, data):
+        '''
+            Parse a serialized index template
+            :param data: The serialized template, raw little-endian uint64 words (or the text format of older versions)
+            :return: The packed index
+        '''
+        if len(data) == cls._index_words * 8:
+            return np.frombuffer(data, dtype='<u8')
+        # Text template of older versions, the space separated index vector
+        index = np.array([int(i) for i in bytes(data).decode('utf-8').split()])
+        return cls.pack_index(np.flatnonzero(index))
+
+
     @staticmethod
     def write_template(username, features):
         '''
-            Write the fingerprint template to a file
+            Write the packed index to the template store, as raw little-endian uint64 words
         '''
 
-        _username = hashlib.sha256(username.encode('utf-8')).hexdigest()  # Hash the username
-        user_path = os.path.join(os.getcwd(), "assets", _username)  # Set the user directory path
-        if not os.path.isdir(user_path):  # Check if the user directory doesn't exist
-            os.mkdir(user_path)
-        with open(os.path.join(user_path, _username + "_index.dat"), "w") as f:
-            for i in features:  # Write the index vector to the file
-                f.write(str(i)+" ")
-            f.close()
+        get_store().put(user_key(username), "index", np.asarray(features, dtype='<u8').tobytes())
 
 
     def read_template(self):
         '''
-            Read the fingerprint template from a file
+            Read the fingerprint template from the template store
         '''
 
-        _username = hashlib.sha256(self._username.encode('utf-8')).hexdigest()  # Hash the username
-        user_path = os.path.join(os.getcwd(), "assets", _username)  # Set the user directory path
-        if not os.path.isdir(user_path):  # Check if the user directory doesn't exist
-            raise FileNotFoundError("The user directory does not exist.")
-        with open(os.path.join(user_path, _username + "_index.dat"), "r") as f:
-            line = f.readline()
-            line = line.strip()
-            self._features = line.split(" ")  # Read the index vector from the file
-            self._features = [int(i) for i in self._features]  # Convert the index elements to integers
-            f.close()
+        with instrumentation.timed("read.index"):
+            data = get_store().get(user_key(self._username), "index")  # Raises FileNotFoundError for unknown users
+            self._features = self.parse_index(data)  # Read the packed index
 
     
     @staticmethod
@@ -80,5 +123,6 @@ class IndexTemplate(BinaryTemplate):
 
         ref_index = reference.get_features()  # Get the index of the reference fingerprint template
         query_index = query.get_features()  # Get the index of the query fingerprint template
-        corr = np.sum(np.bitwise_and(ref_index, query_index))  # Find the common 1's between the two indexes and sum them to find their count
-        return corr/np.sum(query_index)  # The maximum possible corrects is the number of 1's in the query index
+        with instrumentation.timed("match.index"):
+            corr = popcount(np.bitwise_and(ref_index, query_index))  # Find the common 1's between the two indexes and count them
+        return corr/popcount(query_index)  # The maximum possible corrects is the number of 1's in the query index
@@ -0,0 +1,135 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager, nullcontext
+
+enabled = os.environ.get("FINGERPRINT_METRICS", "") == "1"  # Record stage latencies and counters (off by default)
+buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)  # The upper bounds of the latency buckets in seconds
+_prefix = "fingerprint"  # The prefix of the Prometheus metric names
+
+# The recordings of this process. Worker processes record their own: the evaluation's comparison workers return
+# their snapshots, merged into the parent's with merge(); the encryption, decryption and keypair workers only compute
+# and are timed by the parent around the pool
+_lock = threading.Lock()
+_histograms = {}  # stage -> [bucket counts (the last one is +Inf), count, sum]
+_counters = {}  # name -> value
+_disabled = nullcontext()  # Shared, so a disabled timer costs a function call
+
+
+def observe(stage, seconds):
+    '''
+        Record a latency of a stage
+        :param stage: The name of the stage
+        :param seconds: The latency in seconds
+    '''
+    if not enabled:
+        return
+    with _lock:
+        hist = _histograms.get(stage)
+        if hist is None:
+            hist = _histograms[stage] = [[0] * (len(buckets) + 1), 0, 0.0]
+        hist[0][bisect.bisect_left(buckets, seconds)] += 1
+        hist[1] += 1
+        hist[2] += seconds
+
+
+@contextmanager
+def _timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    '''
+        Time a block of code as a stage: with timed("stage"): ...
+        :param stage: The name of the stage
+        :return: The context manager
+    '''
+    if not enabled:
+        return _disabled
+    return _timer(stage)
+
+
+def count(name, value=1):
+    '''
+        Add to a counter
+        :param name: The name of the counter
+        :param value: The amount to add
+    '''
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def reset():
+    '''
+        Clear all the recorded latencies and counters
+    '''
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def merge(snap):
+    '''
+        Add the latencies and counters recorded by another process
+        :param snap: The snapshot() of the other process (None is ignored)
+    '''
+    if not enabled or snap is None:
+        return
+    with _lock:
+        for stage, recorded in snap["stages"].items():
+            hist = _histograms.get(stage)
+            if hist is None:
+                hist = _histograms[stage] = [[0] * (len(buckets) + 1), 0, 0.0]
+            for i, n in enumerate(recorded["buckets"].values()):
+                hist[0][i] += n
+            hist[1] += recorded["count"]
+            hist[2] += recorded["sum"]
+        for name, value in snap["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def snapshot():
+    '''
+        Get the recorded latencies and counters
+        :return: A JSON serializable dictionary: {"stages": {stage: {"count", "sum", "buckets": {upper bound: count}}}, "counters": {name: value}}
+    '''
+    with _lock:
+        stages = {}
+        for stage, (counts, n, total) in _histograms.items():
+            bounds = [str(b) for b in buckets] + ["+Inf"]
+            stages[stage] = {"count": n, "sum": total, "buckets": dict(zip(bounds, counts))}
+        return {"stages": stages, "counters": dict(_counters)}
+
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+
+
+def prometheus():
+    '''
+        Get the recorded latencies and counters in the Prometheus text exposition format
+        :return: The text
+    '''
+    snap = snapshot()
+    lines = []
+    if snap["stages"]:
+        lines.append("# TYPE {}_stage_seconds histogram".format(_prefix))
+    for stage, hist in sorted(snap["stages"].items()):
+        cumulative = 0
+        for bound, n in hist["buckets"].items():  # Prometheus buckets are cumulative
+            cumulative += n
+            lines.append('{}_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(_prefix, stage, bound, cumulative))
+        lines.append('{}_stage_seconds_sum{{stage="{}"}} {}'.format(_prefix, stage, hist["sum"]))
+        lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(_prefix, stage, hist["count"]))
+    for name, value in sorted(snap["counters"].items()):
+        metric = "{}_{}_total".format(_prefix, _metric_name(name))
+        lines.append("# TYPE {} counter".format(metric))
+        lines.append("{} {}".format(metric, value))
+    return "\n".join(lines) + "\n"
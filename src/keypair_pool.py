@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from phe import paillier
+
+keypair_pool_file_name = "keypool.db"  # The name of the keypair pool database under assets/
+default_depth = 8  # The number of keypairs kept generated ahead of time
+default_refill_interval = 0.0  # The seconds to wait between two background generations
+
+
+def _generate(n_length):
+    '''
+        Generate a Paillier keypair (runs in a worker process)
+        :param n_length: The key size in bits
+        :return: The primes p and q of the private key
+    '''
+    _, private_key = paillier.generate_paillier_keypair(n_length=n_length)
+    return private_key.p, private_key.q
+
+
+class KeypairPool:
+    '''
+        A pool of Paillier keypairs generated ahead of time, kept in a SQLite database file readable only by its owner
+        Enrollment takes a ready keypair, or generates one inline when the pool is empty.
+        Every keypair is handed out once and leaves the pool before it is added to a keyring.
+    '''
+
+    def __init__(self, path, depth=default_depth, n_length=paillier.DEFAULT_KEYSIZE, processes=1, refill_interval=default_refill_interval):
+        '''
+            Open the pool file (created if missing)
+            :param path: The path of the database file
+            :param depth: The number of keypairs the background filler keeps in the pool
+            :param n_length: The key size in bits
+            :param processes: The number of background generation processes
+            :param refill_interval: The seconds to wait between two background generations (limits the refill rate)
+        '''
+        self._path = path
+        self._depth = depth
+        self._n_length = n_length
+        self._processes = processes
+        self._refill_interval = refill_interval
+        self._local = threading.local()  # A connection per thread (and per process)
+        self._filler = None
+        self._stop = threading.Event()
+        if not os.path.isfile(path):
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))  # The private keys are only readable by the owner
+        self._connection().execute("CREATE TABLE IF NOT EXISTS keypairs (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                   "n_length INTEGER NOT NULL, p TEXT NOT NULL, q TEXT NOT NULL)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():  # Connections must not cross a fork
+            conn = sqlite3.connect(self._path, isolation_level=None)  # Transactions are explicit
+            conn.execute("PRAGMA journal_mode=WAL")  # Readers do not block the writer
+            conn.execute("PRAGMA secure_delete=ON")  # Deleted private keys are overwritten, not left in free pages
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM keypairs WHERE n_length = ?", (self._n_length,)).fetchone()[0]
+
+    def put(self, p, q):
+        '''
+            Add a keypair to the pool
+            :param p: The first prime of the private key
+            :param q: The second prime of the private key
+        '''
+        self._connection().execute("INSERT INTO keypairs (n_length, p, q) VALUES (?, ?, ?)", (self._n_length, str(p), str(q)))
+
+    def fill(self, count):
+        '''
+            Generate and add keypairs to the pool, split across the generation processes
+            :param count: The number of keypairs to add
+        '''
+        if self._processes <= 1 or count < 2:
+            for _ in range(count):
+                self.put(*_generate(self._n_length))
+            return
+        with ProcessPoolExecutor(max_workers=self._processes) as executor:
+            for p, q in executor.map(_generate, [self._n_length] * count):
+                self.put(p, q)
+
+    def fill_in_background(self):
+        '''
+            Keep the pool at its depth in a background thread, the keypairs are generated in worker processes
+            :return: The filler thread
+        '''
+        def run():
+            with ProcessPoolExecutor(max_workers=self._processes) as executor:
+                while not self._stop.is_set():
+                    missing = self._depth - len(self)
+                    if missing <= 0:
+                        self._stop.wait(max(self._refill_interval, 1.0))  # Wait for enrollments to take keypairs
+                        continue
+                    for p, q in executor.map(_generate, [self._n_length] * min(missing, self._processes)):
+                        self.put(p, q)
+                    self._stop.wait(self._refill_interval)
+        if self._filler is None or not self._filler.is_alive():
+            self._stop.clear()
+            self._filler = threading.Thread(target=run, daemon=True)
+            self._filler.start()
+        return self._filler
+
+    def stop(self):
+        '''
+            Stop the background filler, after the keypairs being generated are added
+        '''
+        self._stop.set()
+        if self._filler is not None:
+            self._filler.join()
+            self._filler = None
+
+    def take(self):
+        '''
+            Remove a keypair from the pool
+            :return: The private key, or None if the pool is empty
+        '''
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")  # Processes sharing the pool never get the same keypair
+        try:
+            row = conn.execute("SELECT id, p, q FROM keypairs WHERE n_length = ? ORDER BY id LIMIT 1", (self._n_length,)).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM keypairs WHERE id = ?", (row[0],))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        p, q = int(row[1]), int(row[2])
+        return paillier.PaillierPrivateKey(paillier.PaillierPublicKey(p * q), p, q)
+
+    def generate_keypair(self, private_keyring=None):
+        '''
+            Get a keypair, as paillier.generate_paillier_keypair does: from the pool, or generated inline if it is empty
+            :param private_keyring: The keyring to add the private key to (optional)
+            :return: The public and the private key
+        '''
+        private_key = self.take()
+        if private_key is None:  # The pool ran dry
+            return paillier.generate_paillier_keypair(private_keyring, self._n_length)
+        if private_keyring is not None:
+            private_keyring.add(private_key)
+        return private_key.public_key, private_key
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from phe import paillier
+from encryption import PackedScore
+
+keyring_file_name = "keyring.db"  # The name of the keyring database under assets/
+default_cache_size = 1024  # The number of private keys kept in memory
+
+
+class KeyringStore:
+    '''
+        A private keyring as the rows of a SQLite database file (readable only by its owner), a private key per row indexed by the public key modulus
+        Keys are loaded on demand (the most recently used are cached) and new keys are appended without rewriting the others
+        It is used as a PaillierPrivateKeyring: add(private key), keyring[public key], public key in keyring, decrypt
+    '''
+
+    def __init__(self, path, cache_size=default_cache_size):
+        '''
+            :param path: The path of the database file (created if missing)
+            :param cache_size: The number of private keys kept in memory
+        '''
+        self._path = path
+        self._cache_size = cache_size
+        self._cache = OrderedDict()  # n -> PaillierPrivateKey, least recently used first
+        self._lock = threading.Lock()  # The cache is shared by the threads
+        self._local = threading.local()  # A connection per thread (and per process)
+        if not os.path.isfile(path):
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))  # The private keys are only readable by the owner
+        else:
+            os.chmod(path, 0o600)  # Keyrings created by earlier versions with the default umask
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS keys (n TEXT PRIMARY KEY, p TEXT NOT NULL, q TEXT NOT NULL) WITHOUT ROWID")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():  # Connections must not cross a fork
+            conn = sqlite3.connect(self._path)
+            conn.execute("PRAGMA journal_mode=WAL")  # Readers do not block the writer
+            conn.execute("PRAGMA secure_delete=ON")  # Deleted private keys are overwritten, not left in free pages
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _cache_key(self, n, key):
+        with self._lock:
+            self._cache[n] = key
+            self._cache.move_to_end(n)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def add(self, private_key):
+        '''
+            Add a private key to the keyring, it is stored right away
+            :param private_key: The PaillierPrivateKey
+        '''
+        if not isinstance(private_key, paillier.PaillierPrivateKey):
+            raise TypeError("private_key should be of type PaillierPrivateKey, not {}".format(type(private_key)))
+        n = private_key.public_key.n
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO keys (n, p, q) VALUES (?, ?, ?)", (str(n), str(private_key.p), str(private_key.q)))
+        conn.commit()
+        self._cache_key(n, private_key)
+
+    def add_many(self, private_keys):
+        '''
+            Add private keys to the keyring, in one transaction
+            :param private_keys: The PaillierPrivateKey objects
+        '''
+        private_keys = list(private_keys)
+        conn = self._connection()
+        with conn:  # Commits, or rolls back on errors
+            conn.executemany("INSERT OR REPLACE INTO keys (n, p, q) VALUES (?, ?, ?)",
+                             [(str(k.public_key.n), str(k.p), str(k.q)) for k in private_keys])
+
+    def __getitem__(self, public_key):
+        '''
+            :param public_key: The PaillierPublicKey
+            :return: The PaillierPrivateKey of the public key
+            :raise KeyError: If the private key is not in the keyring
+        '''
+        n = public_key.n
+        with self._lock:
+            key = self._cache.get(n)
+            if key is not None:
+                self._cache.move_to_end(n)
+                return key
+        row = self._connection().execute("SELECT p, q FROM keys WHERE n = ?", (str(n),)).fetchone()
+        if row is None:
+            raise KeyError(public_key)
+        key = paillier.PaillierPrivateKey(paillier.PaillierPublicKey(n), int(row[0]), int(row[1]))
+        self._cache_key(n, key)
+        return key
+
+    def __delitem__(self, public_key):
+        '''
+            Remove a private key from the keyring
+            :param public_key: The PaillierPublicKey
+            :raise KeyError: If the private key is not in the keyring
+        '''
+        n = public_key.n
+        conn = self._connection()
+        with conn:
+            deleted = conn.execute("DELETE FROM keys WHERE n = ?", (str(n),)).rowcount
+        with self._lock:
+            self._cache.pop(n, None)
+        if deleted == 0:
+            raise KeyError(public_key)
+
+    def __contains__(self, public_key):
+        with self._lock:
+            if public_key.n in self._cache:
+                return True
+        return self._connection().execute("SELECT 1 FROM keys WHERE n = ?", (str(public_key.n),)).fetchone() is not None
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM keys").fetchone()[0]
+
+    def decrypt(self, encrypted_number):
+        '''
+            Decrypt an encrypted number with the private key of its public key
+            :param encrypted_number: The EncryptedNumber
+            :return: The decrypted value
+        '''
+        value = self[encrypted_number.public_key].decrypt(encrypted_number)
+        if isinstance(encrypted_number, PackedScore):  # Packed scores are a slot of the plaintext
+            return encrypted_number.score(value)
+        return value
@@ -0,0 +1,63 @@
+import os
+import argparse
+import readwrite as rw
+import template_store
+from template_store import DirectoryStore, get_store, kinds
+from ciphertext_file import write_ciphertexts, serialize_ciphertexts, is_ciphertext_file, is_ciphertext_data, parse_json_ciphertexts, read_json_ciphertexts
+
+
+def migrate_homomorphic_template(path):
+    '''
+        Convert a JSON homomorphic template of older versions to the binary ciphertext format, in place
+        :param path: The path of the _homomorphic.dat file
+        :return: True if the file was converted, False if it already was in the binary format
+    '''
+    if is_ciphertext_file(path):
+        return False
+    pubkey, encrypted = read_json_ciphertexts(path)
+    write_ciphertexts(path, pubkey, encrypted)
+    return True
+
+
+def migrate_to_store(source, store, batch=1000):
+    '''
+        Copy the templates of a directory store (the per-user directories of older versions) to another store
+        JSON homomorphic templates are converted to the binary ciphertext format on the way
+        :param source: The DirectoryStore to copy from
+        :param store: The TemplateStore to copy to
+        :param batch: The number of users written per transaction
+        :return: The number of users copied
+    '''
+    users = source.users()
+    for start in range(0, len(users), batch):
+        items = []
+        for user in users[start:start + batch]:
+            for kind in kinds:
+                try:
+                    data = source.get(user, kind)
+                except FileNotFoundError:
+                    continue
+                if kind == "homomorphic" and not is_ciphertext_data(data):
+                    data = serialize_ciphertexts(*parse_json_ciphertexts(data))
+                items.append((user, kind, data))
+        store.put_many(items)  # All the templates of a batch are written in one transaction
+    return len(users)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Template migration")
+    parser.add_argument("--store", action="store_true", help="Copy the per-user template directories to the configured template store")
+    args = parser.parse_args()
+    if args.store:
+        if template_store.backend == "directory":
+            raise ValueError("The configured template store is the directory store already.")
+        copied = migrate_to_store(DirectoryStore(rw.assets_dir), get_store())
+        print("{} users copied to the {} template store.".format(copied, template_store.backend))
+    else:
+        converted = 0
+        for user in os.listdir(rw.assets_dir):  # Every user directory is named after the username hash
+            path = os.path.join(rw.assets_dir, user, user + "_homomorphic.dat")
+            if os.path.isfile(path) and migrate_homomorphic_template(path):
+                converted += 1
+                print("Converted {}".format(path))
+        print("{} homomorphic templates converted.".format(converted))
@@ -1,9 +1,12 @@
 import numpy as np
-import os
-import subprocess
-import base64
 import cbor2
 from utils import angle_diff
+from extractor import get_default_pool
+from minutiae_cache import MinutiaeCache, get_default_cache
+import instrumentation
+import struct
+
+_packed_minutia = struct.Struct(">HHdB")  # x, y, theta, type
 
 
 class MinutiaPoint:
@@ -27,19 +30,77 @@ class MinutiaPoint:
     
 
     @staticmethod
-    def extract_minutiae(img_path):
+    def extract_minutiae(img_path, dpi=500):
         '''
             Extract minutiae points from a fingerprint image, using SourceAFIS
             :param img: The path to the fingerprint image
+            :param dpi: The resolution of the image
+            :return: The minutiae points
+        '''
+        return MinutiaPoint.extract_minutiae_batch([img_path], dpi)[0]
+
+
+    @staticmethod
+    def extract_minutiae_batch(img_paths, dpi=500):
+        '''
+            Extract minutiae points from many fingerprint images concurrently, using SourceAFIS
+            Images already seen (same content, DPI and extractor version) are served from the minutiae cache
+            :param img_paths: The paths to the fingerprint images
+            :param dpi: The resolution of the images
+            :return: A list with the minutiae points of each image
+        '''
+        with instrumentation.timed("extract"):
+            cache = get_default_cache()
+            images = []
+            for img_path in img_paths:
+                with open(img_path, "rb") as f:
+                    images.append(f.read())
+                    f.close()
+            keys = [MinutiaeCache.key(img, dpi) for img in images]
+            results = [cache.get(k) for k in keys]
+            misses = [i for i in range(len(results)) if results[i] is None]
+            if misses:
+                with instrumentation.timed("extract.jvm"):
+                    templates = get_default_pool().extract_many(images=[images[i] for i in misses], dpi=dpi)  # Send the new images to the warm SourceAFIS workers
+                for i, template in zip(misses, templates):
+                    results[i] = MinutiaPoint.to_bytes(MinutiaPoint.from_template(template))
+                    cache.put(keys[i], results[i])
+            minutiae = [MinutiaPoint.from_bytes(r) for r in results]
+        if instrumentation.enabled:  # Only sum the minutiae when they are recorded
+            instrumentation.count("extract.images", len(images))
+            instrumentation.count("extract.cache_hits", len(images) - len(misses))
+            instrumentation.count("minutiae", sum(len(m) for m in minutiae))
+        return minutiae
+
+
+    @staticmethod
+    def to_bytes(minutiae):
+        '''
+            Pack minutiae points in a compact binary form
+            :param minutiae: The minutiae points
+            :return: The packed bytes
+        '''
+        return b"".join(_packed_minutia.pack(m.x, m.y, m.theta, m.type) for m in minutiae)
+
+
+    @staticmethod
+    def from_bytes(data):
+        '''
+            Unpack minutiae points packed with to_bytes
+            :param data: The packed bytes
+            :return: The minutiae points
+        '''
+        return [MinutiaPoint(x, y, theta, t) for x, y, theta, t in _packed_minutia.iter_unpack(data)]
+
+
+    @staticmethod
+    def from_template(template):
+        '''
+            Get the minutiae points of a serialized SourceAFIS template
+            :param template: The CBOR serialized template
             :return: The minutiae points
         '''
-        path = os.path.join(os.getcwd(),"external","minutiaeextraction-0.0.1-SNAPSHOT-jar-with-dependencies.jar")  # Get the SourceAFIS API jar file path
-        dpi = "500"
-        cmd = ["java", "-jar", path, img_path, dpi]  # Build the command to run the jar file passing the image path as an argument
-        proc = subprocess.run(cmd, capture_output=True, text=True)  # Run the jar file and capture the output
-        minutiae_b64_str = proc.stdout.strip()
-        minutiae_barr = base64.b64decode(minutiae_b64_str)  # Decode the output from the base64 encoding
-        minutiae_dict = cbor2.loads(minutiae_barr)  # Deserialize from the cbor format to a dictionary
+        minutiae_dict = cbor2.loads(template)  # Deserialize from the cbor format to a dictionary
         # Get the details from the template
         positionsX = minutiae_dict["positionsX"]
         positionsY = minutiae_dict["positionsY"]
@@ -0,0 +1,195 @@
+import os
+import hashlib
+import struct
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from readwrite import assets_dir
+from extractor import extractor_version
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, the cache file is not locked there
+    fcntl = None
+
+cache_file_name = "minutiae_cache.dat"  # The name of the cache file under assets/
+default_max_bytes = 64 * 2**20  # The size bound of the cache
+
+_magic = b"MCACHE01"
+_record_header = struct.Struct(">32sI")  # key, payload length
+
+
+class MinutiaeCache:
+    '''
+        A content-addressed, size bounded LRU cache of extracted minutiae, persisted in a single binary file
+        File layout: magic, then appended records of (32-byte key, uint32 length, payload)
+        The file is shared by processes: it is locked while written, and compacted with the records of the other processes
+    '''
+
+    def __init__(self, path, max_bytes=default_max_bytes):
+        '''
+            Load the cache from its file (if it exists)
+            :param path: The path of the cache file
+            :param max_bytes: The maximum size of the cached payloads
+        '''
+        self._path = path
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> payload, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def key(image, dpi):
+        '''
+            Compute the cache key of an image
+            :param image: The encoded image bytes
+            :param dpi: The resolution of the image
+            :return: The 32-byte key
+        '''
+        h = hashlib.sha256(image)
+        h.update("{}|{}".format(float(dpi), extractor_version).encode("utf-8"))  # Results depend on the DPI and the extractor
+        return h.digest()
+
+    @contextmanager
+    def _file_lock(self):
+        '''
+            Hold the lock of the cache file, so the appends and rewrites of other processes do not interleave
+        '''
+        if fcntl is None:
+            yield
+            return
+        with open(self._path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_records(self):
+        '''
+            Read the records of the cache file
+            :return: The list of the (key, payload) tuples, in file order
+        '''
+        if not os.path.isfile(self._path):
+            return []
+        with open(self._path, "rb") as f:
+            data = f.read()
+            f.close()
+        if not data.startswith(_magic):  # Unknown or corrupted file, start over
+            return []
+        records = []
+        offset = len(_magic)
+        while offset + _record_header.size <= len(data):
+            key, length = _record_header.unpack_from(data, offset)
+            offset += _record_header.size
+            if offset + length > len(data):  # Truncated last record (interrupted write)
+                break
+            records.append((key, data[offset:offset + length]))
+            offset += length
+        return records
+
+    def _load(self):
+        with self._file_lock():
+            records = self._read_records()
+        for key, payload in records:
+            self._insert(key, payload)
+        self._evict()
+
+    def _insert(self, key, payload):
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key))
+        self._entries[key] = payload
+        self._size += len(payload)
+
+    def _evict(self):
+        '''
+            Drop the least recently used entries until the cache fits its bound
+            :return: True if any entry was dropped
+        '''
+        evicted = False
+        while self._size > self._max_bytes and self._entries:
+            _, payload = self._entries.popitem(last=False)
+            self._size -= len(payload)
+            evicted = True
+        return evicted
+
+    def get(self, key):
+        '''
+            Look up a cached payload
+            :param key: The cache key
+            :return: The payload, or None on a miss
+        '''
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)  # Mark as most recently used
+            return payload
+
+    def put(self, key, payload):
+        '''
+            Add a payload to the cache and persist it
+            :param key: The cache key
+            :param payload: The payload bytes
+        '''
+        with self._lock:
+            self._insert(key, payload)
+            if self._evict():
+                self._rewrite()  # Compact the file to the surviving entries
+            else:
+                self._append(key, payload)
+
+    def _append(self, key, payload):
+        with self._file_lock():
+            new_file = not os.path.isfile(self._path)
+            with open(self._path, "ab") as f:
+                if new_file:
+                    f.write(_magic)
+                f.write(_record_header.pack(key, len(payload)) + payload)
+                f.close()
+
+    def _rewrite(self):
+        '''
+            Compact the cache file to the entries that fit the bound, keeping the entries added by other processes
+        '''
+        with self._file_lock():
+            entries = self._entries
+            self._entries, self._size = OrderedDict(), 0
+            for key, payload in self._read_records():  # The entries of other processes are the least recently used here
+                if key not in entries:
+                    self._insert(key, payload)
+            for key, payload in entries.items():
+                self._insert(key, payload)
+            self._evict()
+            tmp_path = self._path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(_magic)
+                for key, payload in self._entries.items():  # Least recently used first, so the order survives a reload
+                    f.write(_record_header.pack(key, len(payload)) + payload)
+                f.close()
+            os.replace(tmp_path, self._path)
+
+    def flush(self):
+        '''
+            Compact the cache file in the current LRU order, merged with the records of other processes
+        '''
+        with self._lock:
+            self._rewrite()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    '''
+        Get the shared minutiae cache stored under assets/
+        :return: The shared MinutiaeCache
+    '''
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = MinutiaeCache(os.path.join(assets_dir, cache_file_name))  # Every put is appended to the file right away
+    return _default_cache
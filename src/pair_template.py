@@ -1,7 +1,8 @@
 import numpy as np
-from minutiae import MinutiaPoint, MinutiaePair
-import hashlib
-import os
+from minutiae import MinutiaPoint
+from utils import angle_diff_array
+from template_store import get_store, user_key
+import instrumentation
 
 
 class FingerprintTemplate:
@@ -14,6 +15,8 @@ class FingerprintTemplate:
     _x_length = 504  # The length of the fingerprint image in the x-axis
     _y_length = 480  # The length of the fingerprint image in the y-axis
     _max_dist = np.sqrt(np.power(_x_length, 2) + np.power(_y_length, 2))  # The maximum distance between two minutiae points
+    _key_field_bits = 16  # The bits of the L, a_i and a_j fields of a pair key
+    _raw_magic = b"PAIR"  # The magic of the binary raw templates, followed by the little-endian uint64 pair keys
     
     def __init__(self, username, minutiae_list=None, reference=False):
         '''
@@ -27,28 +30,94 @@ class FingerprintTemplate:
             
         '''
         self._features = []
+        self._pair_array = None
         self._username = username
         self._reference = reference
 
         if minutiae_list is not None:
-            if type(minutiae_list[0]) == list:  # Registration
-                for minutiae in minutiae_list:
-                    # Initialize the minutiae pairs
-                    for i in range(len(minutiae)):
-                        for j in range(i+1, len(minutiae)):
-                            # Create the quantized symmetric minutiae pairs
-                            self._features.append(MinutiaePair(minutiae[i], minutiae[j]).quantize(self._length_step, self._angle_step))
-                            self._features.append(MinutiaePair(minutiae[j], minutiae[i]).quantize(self._length_step, self._angle_step))
-            elif type(minutiae_list[0]) == MinutiaPoint:  # Verification Query
-                for i in range(len(minutiae_list)):
-                        for j in range(i+1, len(minutiae_list)):
-                            # Create the quantized symmetric minutiae pairs
-                            self._features.append(MinutiaePair(minutiae_list[i], minutiae_list[j]).quantize(self._length_step, self._angle_step))
-                            self._features.append(MinutiaePair(minutiae_list[j], minutiae_list[i]).quantize(self._length_step, self._angle_step))
-            # Keep only the unique minutiae pairs
-            self._features = pairs = list(set(self._features))
+            if type(minutiae_list[0]) == MinutiaPoint:  # Verification Query
+                minutiae_list = [minutiae_list]
+            with instrumentation.timed("pairs"):
+                # Create the quantized symmetric minutiae pairs of every image at once
+                pairs = np.concatenate([self._quantized_pairs(minutiae) for minutiae in minutiae_list])
+                # Keep only the unique minutiae pairs, in order of first appearance
+                _, first = np.unique(self._pair_keys(pairs), return_index=True)
+                self._pair_array = pairs[np.sort(first)]
+                self._features = self._pair_array  # A (L, a_i, a_j, t_i, t_j) row per unique pair
+            instrumentation.count("pairs.unique", len(self._pair_array))
             if self._reference:
-                FingerprintTemplate.write_template(self._username, pairs)  # Save the minutiae pairs to a file (for evaluation purposes)
+                FingerprintTemplate.write_template(self._username, self._pair_array)  # Save the minutiae pairs to a file (for evaluation purposes)
+
+
+    @classmethod
+    def _quantized_pairs(cls, minutiae):
+        '''
+            Compute the quantized minutiae pairs of a fingerprint image as a NumPy array
+            Pairs come in the order of the pairwise MinutiaePair construction: (i,j), (j,i) for every i < j
+            :param minutiae: The list of MinutiaPoint objects of the image
+            :return: An int64 array with a (L, a_i, a_j, t_i, t_j) row per pair
+        '''
+        x = np.array([m.x for m in minutiae], dtype=np.int64)
+        y = np.array([m.y for m in minutiae], dtype=np.int64)
+        theta = np.array([m.theta for m in minutiae], dtype=np.float64)
+        types = np.array([m.type for m in minutiae], dtype=np.int64)
+        upper_i, upper_j = np.triu_indices(len(minutiae), 1)
+        # Interleave every pair (i,j) with its symmetric (j,i)
+        ref = np.stack((upper_i, upper_j), axis=1).ravel()
+        nbr = np.stack((upper_j, upper_i), axis=1).ravel()
+        x_diff = x[nbr] - x[ref]
+        y_diff = y[nbr] - y[ref]
+        phi = np.pi + np.arctan2(y_diff, x_diff)  # Calculate the orientation of the lines connecting the minutiae points
+        phi = np.where(phi - 2*np.pi == 0, 0, phi)  # Keep the range [0,2pi)
+        L = np.sqrt(np.power(x_diff,2) + np.power(y_diff,2)).astype(np.int64)  # Calculate the distances between the minutiae points
+        a_i = angle_diff_array(theta[ref], phi)
+        a_j = angle_diff_array(theta[nbr], phi)
+        # Quantize the local features
+        return np.stack((L//cls._length_step,
+                         np.floor_divide(a_i, cls._angle_step).astype(np.int64),
+                         np.floor_divide(a_j, cls._angle_step).astype(np.int64),
+                         types[ref], types[nbr]), axis=1)
+
+
+    @classmethod
+    def _pair_keys(cls, pairs):
+        '''
+            Pack quantized minutiae pairs into integer keys, equal keys for equal pairs
+            :param pairs: An int array with a (L, a_i, a_j, t_i, t_j) row per pair
+            :return: The uint64 array of the pair keys
+        '''
+        bits = cls._key_field_bits
+        pairs = pairs.astype(np.uint64)
+        return ((pairs[:, 0] << np.uint64(2*bits + 2)) | (pairs[:, 1] << np.uint64(bits + 2)) | (pairs[:, 2] << np.uint64(2)) |
+                (pairs[:, 3] << np.uint64(1)) | pairs[:, 4])
+
+
+    @classmethod
+    def _key_pairs(cls, keys):
+        '''
+            Unpack pair keys into quantized minutiae pairs
+            :param keys: The uint64 array of the pair keys
+            :return: An int64 array with a (L, a_i, a_j, t_i, t_j) row per pair
+        '''
+        bits = cls._key_field_bits
+        mask = np.uint64(2**bits - 1)
+        keys = keys.astype(np.uint64)
+        return np.stack(((keys >> np.uint64(2*bits + 2)) & mask, (keys >> np.uint64(bits + 2)) & mask,
+                         (keys >> np.uint64(2)) & mask, (keys >> np.uint64(1)) & np.uint64(1), keys & np.uint64(1)), axis=1).astype(np.int64)
+
+
+    @classmethod
+    def from_features(cls, username, features, reference=False):
+        '''
+            Create a fingerprint template from features computed elsewhere (e.g. by a TemplateSet), nothing is stored
+            :param username: The username of the user
+            :param features: The features of the template's representation
+            :param reference: If True, the template is a reference template, else it is a query template
+            :return: The fingerprint template
+        '''
+        template = cls(username, reference=reference)
+        template._features = features
+        return template
 
 
     def get_features(self):
@@ -62,37 +131,25 @@ class FingerprintTemplate:
     @staticmethod
     def write_template(username, features):
         '''
-            Write the fingerprint template to a file
+            Write the fingerprint template to the template store, as the magic and the little-endian uint64 pair keys
         '''
 
-        _username = hashlib.sha256(username.encode('utf-8')).hexdigest()  # Hash the username
-        user_path = os.path.join(os.getcwd(), "assets", _username)  # Set the user directory path
-        if not os.path.isdir(user_path):  # Check if the user directory doesn't exist
-            os.mkdir(user_path)
-        with open(os.path.join(user_path, _username + "_raw.dat"), "w") as f:
-            for i in features:
-                f.write(str(i)+"\n")
-            f.close()
+        keys = FingerprintTemplate._pair_keys(np.asarray(features).reshape(-1, 5))
+        get_store().put(user_key(username), "raw", FingerprintTemplate._raw_magic + keys.astype('<u8').tobytes())
 
 
     def read_template(self):
         '''
-            Read the fingerprint template from a file
-        '''
-
-        _username = hashlib.sha256(self._username.encode('utf-8')).hexdigest()  # Hash the username
-        user_path = os.path.join(os.getcwd(), "assets", _username)  # Set the user directory path
-        if not os.path.isdir(user_path):  # Check if the user directory doesn't exist
-            raise FileNotFoundError("The user requested does not exist. Please try again.")
-        with open(os.path.join(user_path, _username + "_raw.dat"), "r") as f:
-            for line in f:  # Each line contains a minutiae pair
-                line = line.strip()
-                L, a_i, a_j, t_i, t_y = line.split(" ")
-                # Get the angle classes
-                a_i,_ = a_i.split(".")
-                a_j,_ = a_j.split(".")
-                self._features.append(MinutiaePair(int(L), int(a_i), int(a_j), int(t_i), int(t_y)))  # Read the minutiae pair from the file
-            f.close()
+            Read the fingerprint template from the template store
+        '''
+
+        data = get_store().get(user_key(self._username), "raw")  # Raises FileNotFoundError for unknown users
+        if bytes(data[:len(self._raw_magic)]) == self._raw_magic:
+            self._pair_array = self._key_pairs(np.frombuffer(data, dtype='<u8', offset=len(self._raw_magic)))
+        else:  # Text template of older versions, a "L a_i.000 a_j.000 t_i t_j" line per minutiae pair
+            fields = bytes(data).decode('utf-8').split()
+            self._pair_array = np.array([int(float(f)) for f in fields], dtype=np.int64).reshape(-1, 5)  # The angle classes are integers
+        self._features = self._pair_array
             
 
     @staticmethod
@@ -104,12 +161,12 @@ class FingerprintTemplate:
             :return: The similarity score between the two templates
         '''
 
-        matches = 0
         ref_pairs = reference.get_features()  # Get the reference minutiae pairs
         query_pairs = query.get_features()  # Get the query minutiae pairs
-        # Count the matches
-        for qpair in query_pairs:
-            for rpair in ref_pairs:
-                if qpair.L == rpair.L and qpair.a_i == rpair.a_i and qpair.a_j == rpair.a_j and qpair.t_i == rpair.t_i and qpair.t_j == rpair.t_j:
-                    matches += 1
+        with instrumentation.timed("match.pairs"):
+            # Count the matches, every equal (query pair, reference pair) combination counts once
+            ref_keys, ref_counts = np.unique(FingerprintTemplate._pair_keys(ref_pairs), return_counts=True)
+            query_keys, query_counts = np.unique(FingerprintTemplate._pair_keys(query_pairs), return_counts=True)
+            _, ref_pos, query_pos = np.intersect1d(ref_keys, query_keys, assume_unique=True, return_indices=True)
+            matches = int(np.dot(ref_counts[ref_pos], query_counts[query_pos]))
         return matches/len(query_pairs)  # The maximum possible matches is the number of pairs in the query template
\ No newline at end of file
@@ -1,6 +1,8 @@
 import os
-import hashlib
 import pickle
+from template_store import get_store, user_key
+from keyring_store import KeyringStore, keyring_file_name
+import instrumentation
 
 assets_dir = os.path.join(os.getcwd(), "assets")  # The path of the assets directory
 dataset_dir_name = "CrossMatch_Sample_DB"  # The name of the dataset directory
@@ -23,14 +25,12 @@ def check_user_existence(username):
         :username: The username to check
         :return: True if the user exists, False otherwise
     '''
-    username = hashlib.sha256(username.encode('utf-8')).hexdigest()  # Hash the username
-    user_path = os.path.join(assets_dir, username)  # Set the user directory path
-    return os.path.isdir(user_path)  # Return True if the user directory exists, False otherwise
+    return get_store().exists(user_key(username))  # Return True if the user has templates in the store, False otherwise
 
 
 def check_keyring_existence():
     '''
-        Check if the keyring file exists
+        Check if the pickled keyring file of older versions exists
         :return: True if the keyring file exists, False otherwise
     '''
     return os.path.isfile(os.path.join(assets_dir, "keyring.dat"))
@@ -38,8 +38,8 @@ def check_keyring_existence():
 
 def load_keyring():
     '''
-        Load the keyring from the keyring file
-        :return: The keyring
+        Load the pickled keyring of older versions from the keyring file
+        :return: The PaillierPrivateKeyring
     '''
     with open(os.path.join(assets_dir, "keyring.dat"), "rb") as f:
         keyring = pickle.load(f)
@@ -47,14 +47,19 @@ def load_keyring():
     return keyring
 
 
-def save_keyring(keyring):
+def open_keyring():
     '''
-        Save the keyring to the keyring file
-        :param keyring: The keyring to save
+        Open the keyring with the private keys, a key per record loaded on demand
+        The pickled keyring of older versions is imported on first use (and kept as keyring.dat.imported)
+        :return: The KeyringStore
     '''
-    with open(os.path.join(assets_dir, "keyring.dat"), "wb") as f:
-        pickle.dump(keyring, f)
-        f.close()
+    with instrumentation.timed("keyring.open"):
+        keyring = KeyringStore(os.path.join(assets_dir, keyring_file_name))
+        if check_keyring_existence():
+            keyring.add_many(load_keyring().values())  # All the keys are imported or none is
+            os.replace(os.path.join(assets_dir, "keyring.dat"), os.path.join(assets_dir, "keyring.dat.imported"))
+            os.chmod(os.path.join(assets_dir, "keyring.dat.imported"), 0o600)  # It still holds the private keys
+    return keyring
 
 
 def get_picture_set_ids():
@@ -0,0 +1,86 @@
+import os
+import sys
+import numpy as np
+from score_store import ScoreStore, read_log, methods
+
+
+def error_rates(scores, genuine, thresholds=None):
+    '''
+        Compute the FAR and FRR curves of a matching method, a comparison is accepted if its score >= threshold
+        :param scores: The scores of the comparisons
+        :param genuine: The genuine flags of the comparisons
+        :param thresholds: The thresholds to evaluate (defaults to all the distinct scores)
+        :return: The thresholds, the FAR and the FRR arrays
+    '''
+    scores = np.asarray(scores, dtype=np.float64)
+    genuine = np.asarray(genuine, dtype=bool)
+    genuine_scores = np.sort(scores[genuine])
+    impostor_scores = np.sort(scores[~genuine])
+    if thresholds is None:
+        thresholds = np.unique(scores)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    # The number of scores below each threshold, by binary search in the sorted scores
+    far = 1 - np.searchsorted(impostor_scores, thresholds, side='left') / max(len(impostor_scores), 1)  # Impostors accepted
+    frr = np.searchsorted(genuine_scores, thresholds, side='left') / max(len(genuine_scores), 1)  # Genuine users rejected
+    return thresholds, far, frr
+
+
+def equal_error_rate(scores, genuine):
+    '''
+        Compute the equal error rate of a matching method
+        :param scores: The scores of the comparisons
+        :param genuine: The genuine flags of the comparisons
+        :return: The EER and its threshold
+    '''
+    thresholds, far, frr = error_rates(scores, genuine)
+    # FAR decreases and FRR increases with the threshold, the EER is where the curves cross
+    i = int(np.argmax(far <= frr)) if np.any(far <= frr) else len(thresholds) - 1
+    if i == 0:
+        return (far[0] + frr[0]) / 2, thresholds[0]
+    # Interpolate linearly between the last threshold before and the first one after the crossing
+    d_prev = far[i-1] - frr[i-1]
+    d_next = far[i] - frr[i]
+    w = d_prev / (d_prev - d_next) if d_prev != d_next else 0.5
+    eer = far[i-1] + w * (far[i] - far[i-1])
+    return eer, thresholds[i-1] + w * (thresholds[i] - thresholds[i-1])
+
+
+def threshold_at_far(scores, genuine, target_far):
+    '''
+        Find the lowest threshold whose FAR does not exceed a target
+        :param scores: The scores of the comparisons
+        :param genuine: The genuine flags of the comparisons
+        :param target_far: The maximum acceptable FAR
+        :return: The threshold, its FAR and its FRR, or (inf, 0, 1) if no threshold meets the target (only rejecting everything does)
+    '''
+    thresholds, far, frr = error_rates(scores, genuine)
+    if not np.any(far <= target_far):
+        return np.inf, 0.0, 1.0
+    i = int(np.argmax(far <= target_far))
+    return thresholds[i], far[i], frr[i]
+
+
+def evaluate(columns, target_fars=(1e-2, 1e-3)):
+    '''
+        Compute the EER and the operating thresholds of all the matching methods
+        :param columns: The score columns (see ScoreStore.load)
+        :param target_fars: The FARs of the operating thresholds to report
+        :return: A dictionary with a summary per method
+    '''
+    summary = {}
+    for method in methods:
+        eer, eer_threshold = equal_error_rate(columns[method], columns["genuine"])
+        summary[method] = {"eer": float(eer), "eer_threshold": float(eer_threshold),
+                           "operating_points": [tuple(float(v) for v in threshold_at_far(columns[method], columns["genuine"], far)) for far in target_fars]}
+    return summary
+
+
+if __name__ == "__main__":
+    # Usage: python roc.py [score store directory | comparison log file]
+    source = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.getcwd(), "log", "final_eval_comp_scores")
+    columns = read_log(source) if os.path.isfile(source) else ScoreStore(source).load()
+    print("{} comparisons ({} genuine)".format(len(columns["genuine"]), int(np.sum(columns["genuine"]))))
+    for method, result in evaluate(columns).items():
+        print("{}: EER {:.4f} at threshold {:.4f}".format(method, result["eer"], result["eer_threshold"]))
+        for threshold, far, frr in result["operating_points"]:
+            print("    threshold {:.4f}: FAR {:.5f} FRR {:.5f}".format(threshold, far, frr))
@@ -0,0 +1,72 @@
+import os
+import glob
+import hashlib
+import numpy as np
+
+methods = ("hom", "ind", "bin")  # The matching methods: homomorphic, index and binary
+
+
+class ScoreStore:
+    '''
+        A columnar store of comparison scores: a directory of .npz chunks with the arrays
+        probe (image id), reference (user id), hom, ind, bin (scores) and genuine (flag)
+    '''
+
+    def __init__(self, path):
+        '''
+            :param path: The directory of the chunks (created if missing)
+        '''
+        self._path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def write_chunk(self, reference, probes, hom_scores, ind_scores, bin_scores, genuine):
+        '''
+            Write the scores of a reference user as one chunk, replacing the chunk of an earlier run of the same user
+            :param reference: The id of the reference user
+            :param probes: The ids of the probe images
+            :param hom_scores: The homomorphic scores
+            :param ind_scores: The index scores
+            :param bin_scores: The binary scores
+            :param genuine: The genuine comparison flags
+        '''
+        name = "chunk_" + hashlib.sha256(reference.encode('utf-8')).hexdigest()[:16] + ".npz"
+        tmp_path = os.path.join(self._path, name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, probe=np.array(probes, dtype=str), reference=np.full(len(probes), reference),
+                     hom=np.asarray(hom_scores, dtype=np.float64), ind=np.asarray(ind_scores, dtype=np.float64),
+                     bin=np.asarray(bin_scores, dtype=np.float64), genuine=np.asarray(genuine, dtype=bool))
+            f.close()
+        os.replace(tmp_path, os.path.join(self._path, name))
+
+    def load(self):
+        '''
+            Load all the chunks
+            :return: A dictionary of the concatenated columns
+        '''
+        columns = {c: [] for c in ("probe", "reference") + methods + ("genuine",)}
+        for chunk_path in sorted(glob.glob(os.path.join(self._path, "chunk_*.npz"))):
+            with np.load(chunk_path) as chunk:
+                for c in columns:
+                    columns[c].append(chunk[c])
+        return {c: np.concatenate(v) if v else np.array([]) for c, v in columns.items()}
+
+
+def read_log(path):
+    '''
+        Read the columns of a comparison log of older versions, with "user img hom ind bin T/F" lines
+        :param path: The path of the log file
+        :return: A dictionary of the columns, as ScoreStore.load returns them
+    '''
+    rows = []
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.split()
+            if parts and parts[0] == "INFO":  # Skip the level name of the log format
+                parts = parts[1:]
+            if len(parts) == 6 and parts[5] in ("T", "F"):
+                rows.append(parts)
+        f.close()
+    rows = np.array(rows, dtype=str).reshape(-1, 6)
+    return {"reference": rows[:, 0], "probe": rows[:, 1], "hom": rows[:, 2].astype(np.float64),
+            "ind": rows[:, 3].astype(np.float64), "bin": rows[:, 4].astype(np.float64), "genuine": rows[:, 5] == "T"}
@@ -0,0 +1,259 @@
+import os
+import json
+import asyncio
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import readwrite as rw
+from minutiae import MinutiaPoint
+from homomorphic_template import HomomorphicTemplate
+from index_template import IndexTemplate
+from gallery import IndexGallery, gallery_file_name
+from decryption import DecryptionService
+import instrumentation
+from keypair_pool import KeypairPool, keypair_pool_file_name, default_depth, default_refill_interval
+from phe import paillier
+
+hot_templates = 1024  # The number of reference templates kept open in memory
+
+
+class MicroBatcher:
+    '''
+        Collect the items submitted by concurrent requests and process them together, in an executor
+        A batch is run once it holds max_batch items, or max_delay seconds after its first item
+    '''
+
+    def __init__(self, func, executor, max_batch=64, max_delay=0.005):
+        '''
+            :param func: The batch function, mapping a list of items to the list of their results
+            :param executor: The executor to run the batch function in
+            :param max_batch: The maximum number of items per batch
+            :param max_delay: The maximum time (in seconds) an item waits for its batch to fill
+        '''
+        self._func = func
+        self._executor = executor
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._pending = []  # (item, future) tuples of the next batch
+        self._timer = None
+
+    async def submit(self, item):
+        '''
+            Add an item to the next batch and wait for its result
+            :param item: The item
+            :return: The result of the item
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self._max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, self._func, [item for item, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:  # Retry every item alone, so one bad item only fails its own request
+                await asyncio.gather(*(self._run([entry]) for entry in batch))
+                return
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class VerificationServer:
+    '''
+        A long-running service with enroll, update, verify and identify operations over newline-delimited JSON
+        Request: {"id": any, "op": "enroll", "username": str, "images": [3 image ids]}
+                 {"id": any, "op": "update", "username": str, "image": image id}
+                 {"id": any, "op": "verify", "username": str, "image": image id}
+                 {"id": any, "op": "identify", "image": image id, "k": int}
+        Response: {"id": same, "ok": true, ...results} or {"id": same, "ok": false, "error": str}
+    '''
+
+    def __init__(self, keyring, gallery, threads=None, processes=None, key_pool=None):
+        '''
+            :param keyring: The keyring with the private keys (KeyringStore or PaillierPrivateKeyring)
+            :param gallery: The IndexGallery of the enrolled users
+            :param threads: The number of threads for extraction, matching and enrollment
+            :param processes: The number of decryption processes
+            :param key_pool: The KeypairPool of the enrollments (optional, keypairs are generated inline without it)
+        '''
+        self._keyring = keyring
+        self._key_pool = key_pool
+        self._gallery = gallery
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._decryptor = DecryptionService(keyring, processes)
+        self._extraction = MicroBatcher(MinutiaPoint.extract_minutiae_batch, self._executor)  # Shared extractor calls
+        self._decryption = MicroBatcher(self._decryptor.decrypt_many, self._executor)  # Shared decryptions
+        self._references = OrderedDict()  # username -> hot reference template, least recently used first
+        self._enroll_lock = None
+        self._enrolling = set()  # The usernames reserved by the enrollments in progress
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _reference(self, username):
+        '''
+            Get the reference template of a user, from the hot templates or memory-mapped from its file
+        '''
+        ref = self._references.get(username)
+        if ref is None:
+            ref = HomomorphicTemplate(username, reference=True)
+            await self._run(ref.read_template, True)
+            self._references[username] = ref
+            if len(self._references) > hot_templates:
+                self._references.popitem(last=False)
+        self._references.move_to_end(username)
+        return ref
+
+    async def _minutiae(self, img_name):
+        img_path = rw.get_image_path(img_name)  # Raises FileNotFoundError for unknown images
+        return await self._extraction.submit(img_path)
+
+    async def enroll(self, username, images):
+        if len(images) != 3 or len(set(images)) != 3:
+            raise ValueError("Three different fingerprint images are required.")
+        async with self._enroll_lock:  # Only the check and the reservation of the username are serialized
+            if username in self._enrolling or rw.check_user_existence(username):
+                raise ValueError("User already exists.")
+            self._enrolling.add(username)
+        try:
+            minutiae_points = await asyncio.gather(*(self._minutiae(i) for i in images))
+            generate = paillier.generate_paillier_keypair if self._key_pool is None else self._key_pool.generate_keypair
+            pubk, _ = await self._run(generate, self._keyring)  # Take (or generate) a new public-private key pair
+            await self._run(HomomorphicTemplate, username, list(minutiae_points), True, pubk)  # Create the template
+            index = IndexTemplate(username, reference=True)
+            await self._run(index.read_template)
+            self._gallery.add(username, index.get_features())  # Make the user identifiable
+            self._references.pop(username, None)
+        finally:
+            self._enrolling.discard(username)
+        return {}
+
+    async def update(self, username, image):
+        async with self._enroll_lock:
+            if username in self._enrolling or not rw.check_user_existence(username):
+                raise ValueError("User does not exist.")
+        minutiae = await self._minutiae(image)
+        changed = await self._run(HomomorphicTemplate.update_template, username, minutiae)  # Concurrent updates are retried by update_template
+        index = IndexTemplate(username, reference=True)
+        await self._run(index.read_template)
+        self._gallery.add(username, index.get_features())
+        self._references.pop(username, None)
+        return {"ciphertexts_changed": changed}
+
+    async def verify(self, username, image):
+        if not rw.check_user_existence(username):
+            raise ValueError("User does not exist.")
+        minutiae, ref = await asyncio.gather(self._minutiae(image), self._reference(username))
+        query = await self._run(IndexTemplate, None, minutiae)  # A homomorphic query is the plaintext packed index
+        match = await self._run(HomomorphicTemplate.match_templates, ref, query)  # Compare the templates
+        return {"score": await self._decryption.submit(match)}  # Decrypt similarity score
+
+    async def identify(self, image, k=5):
+        minutiae = await self._minutiae(image)
+        query = await self._run(IndexTemplate, None, minutiae)
+        candidates = await self._run(self._gallery.identify, query.get_features(), k)
+        return {"candidates": [{"username": u, "score": s} for u, s in candidates]}
+
+    async def _dispatch(self, request):
+        op = request.get("op")
+        if op == "enroll":
+            return await self.enroll(request["username"], request["images"])
+        if op == "update":
+            return await self.update(request["username"], request["image"])
+        if op == "verify":
+            return await self.verify(request["username"], request["image"])
+        if op == "identify":
+            return await self.identify(request["image"], int(request.get("k", 5)))
+        if op == "metrics":  # The stage timings and counters (recorded when instrumentation is enabled)
+            return {"metrics": instrumentation.snapshot(), "prometheus": instrumentation.prometheus()}
+        raise ValueError("Unknown operation {}.".format(op))
+
+    async def _answer(self, line, writer, write_lock):
+        request = {}
+        try:
+            request = json.loads(line)
+            response = {"ok": True, **(await self._dispatch(request))}
+        except Exception as e:
+            response = {"ok": False, "error": str(e)}
+        response["id"] = request.get("id") if isinstance(request, dict) else None
+        async with write_lock:
+            writer.write((json.dumps(response) + "\n").encode("utf-8"))
+            await writer.drain()
+
+    async def _handle(self, reader, writer):
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.create_task(self._answer(line, writer, write_lock))  # Requests of a connection run concurrently
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, unix_path=None):
+        '''
+            Serve requests until cancelled
+            :param host: The host of the TCP server
+            :param port: The port of the TCP server
+            :param unix_path: The path of a Unix socket (used instead of TCP)
+        '''
+        self._enroll_lock = asyncio.Lock()
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self._handle, path=unix_path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self._key_pool is not None:
+            self._key_pool.stop()
+        self._decryptor.close()
+        self._executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Secure Fingerprint Verification Service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="Serve on a Unix socket at this path instead of TCP")
+    parser.add_argument("--key-pool-depth", type=int, default=default_depth, help="The number of keypairs generated ahead of time")
+    parser.add_argument("--key-refill-interval", type=float, default=default_refill_interval, help="The seconds between two background keypair generations")
+    args = parser.parse_args()
+    # Keyring is used to store the private keys
+    keyring = rw.open_keyring()  # Load the private keys on demand
+    gallery = IndexGallery.open(os.path.join(rw.assets_dir, gallery_file_name))
+    key_pool = KeypairPool(os.path.join(rw.assets_dir, keypair_pool_file_name), args.key_pool_depth, refill_interval=args.key_refill_interval)
+    key_pool.fill_in_background()  # Enrollments take keypairs generated ahead of time
+    server = VerificationServer(keyring, gallery, key_pool=key_pool)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
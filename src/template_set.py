@@ -0,0 +1,65 @@
+from pair_template import FingerprintTemplate
+from binary_template import BinaryTemplate
+from index_template import IndexTemplate
+from homomorphic_template import HomomorphicTemplate
+from template_store import get_store
+import time
+
+
+class TemplateSet:
+    '''
+        All the representations of the same fingerprint images, built in one pass:
+        the minutiae pairs are computed once, then binarized, hashed to the index and (optionally) encrypted,
+        and every representation is kept as a template of its class, to be matched with that class's match_templates
+    '''
+
+    def __init__(self, username, minutiae_list, reference=False, pubkey=None, obfuscators=None):
+        '''
+            :param username: The username of the user
+            :param minutiae_list: The input features of the fingerprint images (as for FingerprintTemplate)
+            :param reference: If True, the templates are reference templates and they are stored all or none
+            :param pubkey: The public key of the Pailler cryptosystem, to also build the encrypted index (required for reference templates)
+            :param obfuscators: An ObfuscatorPool of the public key to speed up the encryption (optional)
+        '''
+        if reference and pubkey is None:  # A stored reference always has its homomorphic template
+            raise ValueError("Public key is required for reference templates.")
+        self._username = username
+        self._reference = reference
+        pairs = FingerprintTemplate(username, minutiae_list).get_features()  # The minutiae pairs, computed once
+        codes = BinaryTemplate.codes_of(pairs)
+        index = IndexTemplate.index_of(codes)
+        self.raw = FingerprintTemplate.from_features(username, pairs, reference)
+        self.binary = BinaryTemplate.from_features(username, codes, reference)
+        self.index = IndexTemplate.from_features(username, index, reference)
+        self.homomorphic = None
+        if pubkey is not None:
+            self.homomorphic = HomomorphicTemplate(username, reference=reference, obfuscators=obfuscators)
+            self.homomorphic._encrypt_index(index, pubkey)  # Encrypted before the store is locked
+        if reference:
+            with get_store().transaction():  # The templates are stored all or none
+                FingerprintTemplate.write_template(username, pairs)
+                BinaryTemplate.write_template(username, codes)
+                IndexTemplate.write_template(username, index)
+                self.homomorphic.write_template()
+                HomomorphicTemplate.write_metadata(username, {"version": 1, "username": username, "created": time.time(), "updates": []})
+
+
+    def match_templates(self, reference):
+        '''
+            Match the templates of a query with those of a reference, by every method
+            :param reference: The reference TemplateSet, or a dictionary "raw"/"binary"/"index"/"homomorphic" -> reference template
+                              (the methods without a reference template are skipped)
+            :return: A dictionary method -> similarity score (the homomorphic score is encrypted)
+        '''
+        if isinstance(reference, TemplateSet):
+            reference = {"raw": reference.raw, "binary": reference.binary, "index": reference.index, "homomorphic": reference.homomorphic}
+        scores = {}
+        if reference.get("raw") is not None:
+            scores["raw"] = FingerprintTemplate.match_templates(reference["raw"], self.raw)
+        if reference.get("binary") is not None:
+            scores["binary"] = BinaryTemplate.match_templates(reference["binary"], self.binary)
+        if reference.get("index") is not None:
+            scores["index"] = IndexTemplate.match_templates(reference["index"], self.index)
+        if reference.get("homomorphic") is not None:  # A homomorphic query is the plaintext packed index
+            scores["homomorphic"] = HomomorphicTemplate.match_templates(reference["homomorphic"], self.index)
+        return scores
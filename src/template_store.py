@@ -0,0 +1,378 @@
+import os
+import mmap
+import shutil
+import hashlib
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import instrumentation
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, transactions of the directory store are not locked there
+    fcntl = None
+
+backend = "sqlite"  # The template store backend: "sqlite" (single file) or "directory" (a directory of files per user)
+store_file_name = "templates.db"  # The name of the SQLite store under assets/
+lock_file_name = "templates.lock"  # The name of the lock file of the directory store under assets/
+busy_timeout = 60.0  # The seconds a write waits for the writer of another connection to finish
+kinds = ("raw", "binary", "index", "homomorphic", "meta")  # The template kinds of a user ("meta" is the version metadata)
+
+
+def user_key(username):
+    '''
+        Get the key of a user in the template stores
+        :param username: The username
+        :return: The SHA-256 hash of the username
+    '''
+    return hashlib.sha256(username.encode('utf-8')).hexdigest()  # Hash the username
+
+
+class TemplateStore(ABC):
+    '''
+        The interface of the template stores: serialized templates are kept per (user key, template kind)
+        A backend implements get, put, exists, users and delete, the other methods are built on them
+    '''
+
+    @abstractmethod
+    def get(self, user, kind):
+        '''
+            :param user: The user key
+            :param kind: The template kind
+            :return: The serialized template
+            :raise FileNotFoundError: If the user or the template does not exist
+        '''
+
+    def map(self, user, kind):
+        '''
+            Get a serialized template for random access, only the accessed bytes are read if the backend allows it
+            :param user: The user key
+            :param kind: The template kind
+            :return: An object supporting slicing and len (mmap.mmap when memory-mapped, SQLiteBlob for the SQLite store)
+        '''
+        return self.get(user, kind)
+
+    @abstractmethod
+    def put(self, user, kind, data):
+        '''
+            :param user: The user key
+            :param kind: The template kind
+            :param data: The serialized template
+        '''
+
+    def patch(self, user, kind, chunks):
+        '''
+            Overwrite parts of a serialized template, its size is unchanged
+            :param user: The user key
+            :param kind: The template kind
+            :param chunks: An iterable of (byte offset, bytes) tuples
+            :raise FileNotFoundError: If the user or the template does not exist
+        '''
+        data = bytearray(self.get(user, kind))
+        for offset, chunk in chunks:
+            data[offset:offset + len(chunk)] = chunk
+        self.put(user, kind, bytes(data))
+
+    def get_many(self, users, kind):
+        '''
+            Bulk read of the templates of a kind
+            :param users: The user keys
+            :param kind: The template kind
+            :return: A dictionary user key -> serialized template (users without the template are left out)
+        '''
+        found = {}
+        for user in users:
+            try:
+                found[user] = self.get(user, kind)
+            except FileNotFoundError:
+                pass
+        return found
+
+    def put_many(self, items):
+        '''
+            Bulk write of templates, in one transaction
+            :param items: An iterable of (user key, kind, serialized template) tuples
+        '''
+        with self.transaction():
+            for user, kind, data in items:
+                self.put(user, kind, data)
+
+    @abstractmethod
+    def exists(self, user):
+        '''
+            :param user: The user key
+            :return: True if the user has templates, False otherwise
+        '''
+
+    @abstractmethod
+    def users(self):
+        '''
+            :return: The list of the user keys
+        '''
+
+    @abstractmethod
+    def delete(self, user):
+        '''
+            Delete all the templates of a user
+            :param user: The user key
+        '''
+
+    @contextmanager
+    def transaction(self):
+        '''
+            Group reads and writes: the writes are all applied or none is, and other transactions do not write in between
+        '''
+        yield
+
+
+class DirectoryStore(TemplateStore):
+    '''
+        Templates as files: <root>/<user key>/<user key>_<kind>.dat (the layout of older versions)
+        A transaction holds an exclusive lock on <root>/templates.lock (where file locks are available), so the
+        transactions of different threads and processes do not interleave; files are still replaced one at a time
+    '''
+
+    def __init__(self, root):
+        '''
+            :param root: The assets directory
+        '''
+        self._root = root
+        self._local = threading.local()  # The transaction depth of every thread
+
+    def _path(self, user, kind):
+        return os.path.join(self._root, user, user + "_" + kind + ".dat")
+
+    def get(self, user, kind):
+        with open(self._path(user, kind), "rb") as f:  # Raises FileNotFoundError for missing templates
+            data = f.read()
+            f.close()
+        instrumentation.count("store.bytes_read", len(data))
+        return data
+
+    def map(self, user, kind):
+        with open(self._path(user, kind), "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # The mapping stays valid after closing the file
+            f.close()
+        instrumentation.count("store.maps")
+        return mapping
+
+    def put(self, user, kind, data):
+        user_path = os.path.join(self._root, user)  # Set the user directory path
+        if not os.path.isdir(user_path):  # Check if the user directory doesn't exist
+            os.mkdir(user_path)
+        path = self._path(user, kind)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+            f.close()
+        os.replace(path + ".tmp", path)
+        instrumentation.count("store.bytes_written", len(data))
+
+    def patch(self, user, kind, chunks):
+        path = self._path(user, kind)
+        shutil.copyfile(path, path + ".tmp")  # Raises FileNotFoundError for missing templates
+        with open(path + ".tmp", "r+b") as f:  # The chunks are written to a copy, a crash never leaves a torn template
+            for offset, chunk in chunks:
+                f.seek(offset)
+                f.write(chunk)
+                instrumentation.count("store.bytes_written", len(chunk))
+            f.close()
+        os.replace(path + ".tmp", path)
+
+    def exists(self, user):
+        return os.path.isdir(os.path.join(self._root, user))
+
+    def users(self):
+        return [u for u in os.listdir(self._root) if len(u) == 64 and os.path.isdir(os.path.join(self._root, u))]
+
+    def delete(self, user):
+        shutil.rmtree(os.path.join(self._root, user), ignore_errors=True)
+
+    @contextmanager
+    def transaction(self):
+        depth = getattr(self._local, "depth", 0)
+        lock = None
+        if depth == 0 and fcntl is not None:
+            lock = open(os.path.join(self._root, lock_file_name), "a")
+            fcntl.flock(lock, fcntl.LOCK_EX)  # Wait for the transactions of other threads and processes
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if lock is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                lock.close()
+
+
+class SQLiteBlob:
+    '''
+        A read-only view of a template of the SQLite store for random access, only the sliced bytes are read
+        Every read opens the row's blob on the connection of the calling thread, unless the view is held open by reading()
+    '''
+
+    def __init__(self, store, rowid, size):
+        '''
+            :param store: The SQLiteStore
+            :param rowid: The rowid of the template
+            :param size: The size of the template in bytes
+        '''
+        self._store = store
+        self._rowid = rowid
+        self._size = size
+        self._local = threading.local()  # The blob held open by reading() on every thread
+
+    def _open(self):
+        try:
+            return self._store._connection().blobopen("templates", "data", self._rowid, readonly=True)
+        except sqlite3.OperationalError:  # The row is gone
+            raise FileNotFoundError("The template was deleted.")
+
+    @contextmanager
+    def reading(self):
+        '''
+            Keep the blob open on this thread for a series of reads (opening it walks the row's pages)
+        '''
+        if getattr(self._local, "blob", None) is not None:
+            yield
+            return
+        self._local.blob = self._open()
+        try:
+            yield
+        finally:
+            self._local.blob.close()
+            self._local.blob = None
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, key):
+        blob = getattr(self._local, "blob", None)
+        if blob is not None:
+            data = blob[key]
+        else:
+            with self._open() as blob:
+                data = blob[key]
+        instrumentation.count("store.bytes_read", len(data))
+        return data
+
+
+class SQLiteStore(TemplateStore):
+    '''
+        Templates as the rows of a single SQLite database file
+        A template keeps its rowid when it is rewritten, so the blobs of the rows serve random access (see map)
+    '''
+
+    def __init__(self, path):
+        '''
+            :param path: The path of the database file (created if missing)
+        '''
+        self._path = path
+        self._local = threading.local()  # A connection per thread (and per process)
+        with self.transaction():
+            conn = self._connection()
+            row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'templates'").fetchone()
+            if row is not None and "WITHOUT ROWID" in row[0].upper():  # The table of older versions has no blobs to open
+                conn.execute("ALTER TABLE templates RENAME TO templates_old")
+            conn.execute("CREATE TABLE IF NOT EXISTS templates (id INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT NOT NULL, "
+                         "kind TEXT NOT NULL, data BLOB NOT NULL, UNIQUE (user, kind))")
+            if row is not None and "WITHOUT ROWID" in row[0].upper():
+                conn.execute("INSERT INTO templates (user, kind, data) SELECT user, kind, data FROM templates_old")
+                conn.execute("DROP TABLE templates_old")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():  # Connections must not cross a fork
+            conn = sqlite3.connect(self._path, timeout=busy_timeout)
+            conn.execute("PRAGMA journal_mode=WAL")  # Readers do not block the writer
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.depth = 0
+        return conn
+
+    def get(self, user, kind):
+        row = self._connection().execute("SELECT data FROM templates WHERE user = ? AND kind = ?", (user, kind)).fetchone()
+        if row is None:
+            raise FileNotFoundError("The {} template of the user does not exist.".format(kind))
+        instrumentation.count("store.bytes_read", len(row[0]))
+        return row[0]
+
+    def map(self, user, kind):
+        if not hasattr(sqlite3.Connection, "blobopen"):  # Python < 3.11, the template is read whole
+            return self.get(user, kind)
+        row = self._connection().execute("SELECT id, length(data) FROM templates WHERE user = ? AND kind = ?", (user, kind)).fetchone()
+        if row is None:
+            raise FileNotFoundError("The {} template of the user does not exist.".format(kind))
+        instrumentation.count("store.maps")
+        return SQLiteBlob(self, *row)
+
+    def get_many(self, users, kind):
+        conn = self._connection()
+        found = {}
+        users = list(users)
+        for start in range(0, len(users), 500):  # Keep below the limit of the query parameters
+            chunk = users[start:start + 500]
+            query = "SELECT user, data FROM templates WHERE kind = ? AND user IN ({})".format(",".join("?" * len(chunk)))
+            found.update(conn.execute(query, [kind] + chunk).fetchall())
+        if instrumentation.enabled:  # Only sum the sizes when they are recorded
+            instrumentation.count("store.bytes_read", sum(len(data) for data in found.values()))
+        return found
+
+    def put(self, user, kind, data):
+        conn = self._connection()
+        conn.execute("INSERT INTO templates (user, kind, data) VALUES (?, ?, ?) "
+                     "ON CONFLICT (user, kind) DO UPDATE SET data = excluded.data", (user, kind, data))  # Keeps the rowid
+        instrumentation.count("store.bytes_written", len(data))
+        if self._local.depth == 0:  # Not inside a transaction
+            conn.commit()
+
+    def exists(self, user):
+        return self._connection().execute("SELECT 1 FROM templates WHERE user = ? LIMIT 1", (user,)).fetchone() is not None
+
+    def users(self):
+        return [row[0] for row in self._connection().execute("SELECT DISTINCT user FROM templates")]
+
+    def delete(self, user):
+        conn = self._connection()
+        conn.execute("DELETE FROM templates WHERE user = ?", (user,))
+        if self._local.depth == 0:
+            conn.commit()
+
+    @contextmanager
+    def transaction(self):
+        conn = self._connection()
+        if self._local.depth == 0 and not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")  # Take the write lock now, so the reads of the transaction stay current
+        self._local.depth += 1
+        try:
+            yield
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.rollback()
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            conn.commit()
+
+
+_stores = {}  # backend -> the default store (the SQLite store keeps a connection per thread and process)
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    '''
+        Get the default template store, as configured by the backend variable
+        :return: The TemplateStore
+    '''
+    assets_dir = os.path.join(os.getcwd(), "assets")  # The path of the assets directory
+    with _stores_lock:
+        store = _stores.get(backend)
+        if store is None:
+            if backend == "sqlite":
+                store = SQLiteStore(os.path.join(assets_dir, store_file_name))
+            elif backend == "directory":
+                store = DirectoryStore(assets_dir)
+            else:
+                raise ValueError("Unknown template store backend {}.".format(backend))
+            _stores[backend] = store
+    return store
@@ -15,16 +15,54 @@ def angle_diff(theta1, theta2):
             diff = 2*np.pi - diff  # Subtract the angle difference from 2*pi to normalize it in the [0,2*pi) range
         return diff
 
-# Used for reduce vector size in HomomorphicTemplate (Not used in this implementation)
-def generate_uniform_matrix(n, m, seed):
+_popcount_table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)  # The number of 1's of every byte value
+
+def popcount(words):
+    '''
+        Count the set bits of a packed bit array
+        :param words: The array of the packed bits (any unsigned integer type)
+        :return: The number of 1's
+    '''
+    return int(_popcount_table[np.ascontiguousarray(words).view(np.uint8)].sum(dtype=np.int64))
+
+
+def popcount_rows(words):
+    '''
+        Count the set bits of every row of a packed bit matrix
+        :param words: The 2D array of the packed bits, a row per bitset
+        :return: The int64 array of the number of 1's per row
+    '''
+    words = np.ascontiguousarray(words)
+    return _popcount_table[words.view(np.uint8)].reshape(len(words), -1).sum(axis=1, dtype=np.int64)
+
+
+def _splitmix64(x):
     '''
-    Generate a random matrix with uniform distribution real values in the range [-1,1]
-    :param n: The number of rows of the matrix
-    :param m: The number of columns of the matrix
-    :param seed: The seed for the random number generator
+        Mix 64-bit integers (the SplitMix64 finalizer), a different pseudo-random value for every input
+        :param x: The uint64 array
+        :return: The mixed uint64 array
     '''
-    np.random.seed(seed)  # Set the seed for the random number generator
-    return np.random.uniform(-1, 1, (n, m))  # Generate a random matrix with uniform distribution real values in the range [-1,1]
+    with np.errstate(over='ignore'):  # The arithmetic is modulo 2^64
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+# Used to reduce the vector size in HomomorphicTemplate
+def uniform_matrix_rows(rows, m, seed):
+    '''
+        Get rows of a seeded random matrix with uniform distribution real values in the range [-1,1), without building the matrix
+        Every element is a hash of the seed and its position, so any rows are generated on their own and always agree
+        :param rows: The indexes of the rows
+        :param m: The number of columns of the matrix
+        :param seed: The seed of the matrix
+        :return: A float64 array with a row per index
+    '''
+    rows = np.asarray(rows, dtype=np.uint64).reshape(-1, 1)
+    counters = rows * np.uint64(m) + np.arange(m, dtype=np.uint64)  # The position of every element in the matrix
+    bits = _splitmix64(counters ^ _splitmix64(np.uint64(seed)))
+    return (bits >> np.uint64(11)) * (2.0 / 2**53) - 1.0  # 53 random bits scaled to [-1,1)
 
 
 def encrypted_xor(a,b):
@@ -34,4 +72,15 @@ def encrypted_xor(a,b):
         :param b: The plaintext bit
         :return: The encrypted XOR
     '''
-    return a + b -2*a*b
\ No newline at end of file
+    return a + b -2*a*b
+
+def angle_diff_array(theta1, theta2):
+        '''
+            Vectorized angle_diff: element-wise theta1 - theta2 normalized in the [0,2*pi) range, with the same arithmetic
+            :param theta1: The first angles (NumPy array)
+            :param theta2: The second angles (NumPy array)
+            :return: The normalized differences
+        '''
+        diff = theta1 - theta2
+        diff = np.where(diff < 0, diff + 2*np.pi, np.where(diff >= 2*np.pi, 2*np.pi - diff, diff))  # Same branches as angle_diff
+        return diff
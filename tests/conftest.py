@@ -0,0 +1,55 @@
+import os
+import sys
+import random
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))  # The modules are run from src/
+
+import template_store
+from phe import paillier
+from benchmark import synthetic_minutiae, synthetic_impression
+
+
+@pytest.fixture
+def assets(tmp_path, monkeypatch):
+    '''
+        An empty assets directory under the working directory, with fresh template stores
+    '''
+    (tmp_path / "assets").mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(template_store, "_stores", {})
+    return tmp_path / "assets"
+
+
+@pytest.fixture(params=["sqlite", "directory"])
+def backend(request, assets, monkeypatch):
+    '''
+        Every test using it runs on both template store backends
+    '''
+    monkeypatch.setattr(template_store, "backend", request.param)
+    return request.param
+
+
+@pytest.fixture(scope="session")
+def keypair():
+    '''
+        A small Paillier keypair, shared by the tests
+    '''
+    return paillier.generate_paillier_keypair(n_length=512)
+
+
+@pytest.fixture
+def finger():
+    '''
+        The impressions of a synthetic finger: a function returning a new impression on every call
+    '''
+    rng = random.Random(7)
+    minutiae = synthetic_minutiae(35, rng)
+    return lambda: synthetic_impression(minutiae, rng)
+
+
+@pytest.fixture
+def other_finger():
+    rng = random.Random(11)
+    minutiae = synthetic_minutiae(35, rng)
+    return lambda: synthetic_impression(minutiae, rng)
@@ -0,0 +1,72 @@
+import json
+import struct
+import pytest
+from ciphertext_file import CiphertextFile, serialize_ciphertexts, is_ciphertext_data, parse_json_ciphertexts, format_version
+
+
+@pytest.fixture
+def encrypted(keypair):
+    pubkey, _ = keypair
+    return [pubkey.encrypt(v) for v in (3, 0, 7, 1)]
+
+
+def test_round_trip(keypair, encrypted):
+    pubkey, private_key = keypair
+    data = serialize_ciphertexts(pubkey, encrypted, slot_bits=57, slots=4, length=13)
+    assert is_ciphertext_data(data)
+    template = CiphertextFile(data)
+    assert template.pubkey == pubkey
+    assert (template.slot_bits, template.slots, template.length, len(template)) == (57, 4, 13, 4)
+    assert [template.ciphertext(i) for i in range(4)] == [c.ciphertext(be_secure=False) for c in encrypted]
+    assert [private_key.decrypt(c) for c in template] == [3, 0, 7, 1]
+
+
+def test_exponents_are_aligned(keypair):
+    pubkey, private_key = keypair
+    values = [pubkey.encrypt(0.5), pubkey.encrypt(2)]
+    template = CiphertextFile(serialize_ciphertexts(pubkey, values))
+    assert [private_key.decrypt(c) for c in template.encrypted_numbers()] == [0.5, 2]
+
+
+def test_version_1_files_are_not_packed(keypair, encrypted):
+    pubkey, private_key = keypair
+    data = serialize_ciphertexts(pubkey, encrypted)
+    header = struct.Struct(">4sHIIIi")
+    magic, _, n_bytes, c_bytes, count, exponent = header.unpack_from(data)
+    v1 = header.pack(magic, 1, n_bytes, c_bytes, count, exponent) + data[header.size + 8:]  # Without the packing fields
+    template = CiphertextFile(v1)
+    assert (template.slot_bits, template.slots, template.length) == (1, 1, 4)
+    assert [private_key.decrypt(c) for c in template] == [3, 0, 7, 1]
+
+
+def test_invalid_files_are_refused(keypair, encrypted):
+    pubkey, _ = keypair
+    data = serialize_ciphertexts(pubkey, encrypted)
+    with pytest.raises(ValueError):
+        CiphertextFile(data[:-1])  # Truncated
+    with pytest.raises(ValueError):
+        CiphertextFile(data[:4] + struct.pack(">H", format_version + 1) + data[6:])  # From a newer version
+    with pytest.raises(ValueError):
+        CiphertextFile(b"JUNK" + data[4:])
+
+
+def test_patches_match_a_new_serialization(keypair, encrypted):
+    pubkey, private_key = keypair
+    data = bytearray(serialize_ciphertexts(pubkey, encrypted))
+    replacement = pubkey.encrypt(9)
+    for offset, chunk in CiphertextFile(bytes(data)).patches({2: replacement}):
+        data[offset:offset + len(chunk)] = chunk
+    expected = serialize_ciphertexts(pubkey, encrypted[:2] + [replacement] + encrypted[3:])
+    assert bytes(data) == expected
+    with pytest.raises(IndexError):
+        CiphertextFile(bytes(data)).patches({4: replacement})
+
+
+def test_json_templates_of_older_versions(keypair, encrypted):
+    pubkey, private_key = keypair
+    data = json.dumps({"pubkey": {"n": str(pubkey.n)},
+                       "features": [(str(c.ciphertext()), c.exponent) for c in encrypted]}).encode("utf-8")
+    assert not is_ciphertext_data(data)
+    parsed_key, parsed = parse_json_ciphertexts(data)
+    assert parsed_key == pubkey
+    assert [private_key.decrypt(c) for c in parsed] == [3, 0, 7, 1]
@@ -0,0 +1,57 @@
+import secrets
+import numpy as np
+import pytest
+from encryption import ObfuscatorPool, encrypt_vector, pack_vector, packing_slots, score_mask, PackedScore
+
+
+def test_pack_vector_places_element_i_in_slot_i_mod_slots():
+    vector = np.zeros(10, dtype=np.uint8)
+    vector[[0, 3, 4, 9]] = 1
+    packed = pack_vector(vector, 8, 4)
+    assert packed == [1 | 1 << 24, 1, 1 << 8]
+
+
+def test_packed_product_fits_below_max_int(keypair):
+    pubkey, _ = keypair
+    slots = packing_slots(pubkey, 57, 40)
+    assert slots > 1
+    assert 57 * (2*slots - 1) + 40 <= pubkey.max_int.bit_length()
+
+
+def test_encrypt_vector_matches_encrypt(keypair):
+    pubkey, private_key = keypair
+    values = [0, 1, 5, 2**40]
+    pool = ObfuscatorPool(pubkey)
+    pool.fill(2, processes=1)
+    encrypted = encrypt_vector(pubkey, values, pool, processes=1)
+    assert len(pool) == 0  # Every obfuscator is used once
+    assert [private_key.decrypt(c) for c in encrypted] == values
+
+
+def test_encrypt_vector_rejects_a_pool_of_another_key(keypair):
+    pubkey, _ = keypair
+    from phe import paillier
+    other, _ = paillier.generate_paillier_keypair(n_length=256)
+    with pytest.raises(ValueError):
+        encrypt_vector(pubkey, [1], ObfuscatorPool(other))
+
+
+def test_masked_packed_score_keeps_only_the_score_slot(keypair):
+    pubkey, private_key = keypair
+    slot_bits, bound = 57, 2000
+    slots = packing_slots(pubkey, slot_bits, 40)
+    shift = slot_bits * (slots - 1)
+    for _ in range(20):
+        values = [secrets.randbelow(bound + 1) for _ in range(2*slots - 1)]  # Every slot of a product of packed plaintexts
+        product = sum(v << (slot_bits * i) for i, v in enumerate(values))
+        mask = score_mask(pubkey, shift, slot_bits, bound, 40)
+        ciphertext = pubkey.raw_encrypt(product + mask)
+        score = PackedScore(pubkey, ciphertext, shift, slot_bits, bound)
+        assert score.score(private_key.raw_decrypt(ciphertext)) == values[slots - 1] / bound
+
+
+def test_score_mask_refuses_narrow_slots(keypair):
+    pubkey, _ = keypair
+    slots = packing_slots(pubkey, 17)
+    with pytest.raises(ValueError):
+        score_mask(pubkey, 17 * (slots - 1), 17, 2000, 40)
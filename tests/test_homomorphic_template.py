@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from homomorphic_template import HomomorphicTemplate
+from index_template import IndexTemplate
+from ciphertext_file import CiphertextFile
+from encryption import pack_vector, ObfuscatorPool
+from template_store import get_store, user_key
+
+
+@pytest.fixture
+def reduced(monkeypatch):
+    monkeypatch.setattr(HomomorphicTemplate, "_reduced", True)
+
+
+def expected_score(username, reference_index, query_index, length):
+    '''
+        The score of a reference template, computed on the plaintext vectors
+    '''
+    ref_vector = HomomorphicTemplate.plain_vector(username, reference_index, length).astype(int)
+    query_vector = HomomorphicTemplate.plain_vector(username, query_index, length).astype(int)
+    return np.dot(ref_vector, query_vector) / query_vector.sum()
+
+
+def decrypt_score(private_key, score):
+    value = private_key.raw_decrypt(score.ciphertext(be_secure=False))
+    return score.score(value) if hasattr(score, "score") else private_key.decrypt(score)
+
+
+def test_packed_score_equals_the_index_score(assets, keypair, finger, other_finger):
+    pubkey, private_key = keypair
+    obfuscators = ObfuscatorPool(pubkey)
+    obfuscators._values.extend([1] * HomomorphicTemplate.ciphertext_count(pubkey))  # Trivial obfuscators, the plaintexts are the same
+    HomomorphicTemplate("alice", [finger() for _ in range(3)], True, pubkey, obfuscators)
+    reference = HomomorphicTemplate("alice", reference=True)
+    reference.read_template(lazy=True)
+    assert reference._slots > 1
+    index = IndexTemplate("alice", reference=True)
+    index.read_template()
+    for query in (IndexTemplate(None, [finger()]), IndexTemplate(None, [other_finger()])):
+        score = decrypt_score(private_key, HomomorphicTemplate.match_templates(reference, query))
+        assert score == IndexTemplate.match_templates(index, query)
+
+
+@pytest.mark.parametrize("packed", [True, False])
+def test_reduced_scores(backend, reduced, monkeypatch, keypair, finger, other_finger, packed):
+    monkeypatch.setattr(HomomorphicTemplate, "_packed", packed)
+    pubkey, private_key = keypair
+    HomomorphicTemplate("alice", [finger() for _ in range(3)], True, pubkey)
+    index = IndexTemplate("alice", reference=True)
+    index.read_template()
+    for lazy in (False, True):
+        reference = HomomorphicTemplate("alice", reference=True)
+        reference.read_template(lazy=lazy)
+        for query in (IndexTemplate(None, [finger()]), IndexTemplate(None, [other_finger()])):
+            score = decrypt_score(private_key, HomomorphicTemplate.match_templates(reference, query))
+            assert score == expected_score("alice", index.get_features(), query.get_features(), reference._length)
+
+
+def test_masked_plaintexts_differ(assets, reduced, keypair, finger):
+    pubkey, private_key = keypair
+    HomomorphicTemplate("alice", [finger() for _ in range(3)], True, pubkey)
+    reference = HomomorphicTemplate("alice", reference=True)
+    reference.read_template()
+    query = IndexTemplate(None, [finger()])
+    first, second = (HomomorphicTemplate.match_templates(reference, query) for _ in range(2))
+    assert private_key.raw_decrypt(first.ciphertext(False)) != private_key.raw_decrypt(second.ciphertext(False))
+    assert decrypt_score(private_key, first) == decrypt_score(private_key, second)
+
+
+def test_narrow_slots_of_older_versions_are_refused(assets, reduced, monkeypatch, keypair, finger):
+    pubkey, _ = keypair
+    slot_bits, mask_bits = HomomorphicTemplate._slot_bits, HomomorphicTemplate._mask_bits
+    monkeypatch.setattr(HomomorphicTemplate, "_slot_bits", 16)
+    monkeypatch.setattr(HomomorphicTemplate, "_mask_bits", 0)
+    HomomorphicTemplate("alice", [finger() for _ in range(3)], True, pubkey)
+    monkeypatch.setattr(HomomorphicTemplate, "_slot_bits", slot_bits)
+    monkeypatch.setattr(HomomorphicTemplate, "_mask_bits", mask_bits)
+    reference = HomomorphicTemplate("alice", reference=True)
+    reference.read_template()
+    with pytest.raises(ValueError):
+        HomomorphicTemplate.match_templates(reference, IndexTemplate(None, [finger()]))
+
+
+def test_update_rewrites_the_changed_ciphertexts(backend, reduced, keypair, finger):
+    pubkey, private_key = keypair
+    HomomorphicTemplate("alice", [finger() for _ in range(3)], True, pubkey)
+    changed = HomomorphicTemplate.update_template("alice", finger())
+    assert changed > 0
+    template = CiphertextFile(get_store().get(user_key("alice"), "homomorphic"))
+    index = IndexTemplate("alice", reference=True)
+    index.read_template()
+    vector = HomomorphicTemplate.plain_vector("alice", index.get_features(), template.length)
+    assert [private_key.decrypt(c) for c in template] == pack_vector(vector, template.slot_bits, template.slots)
+    meta = HomomorphicTemplate.read_metadata("alice")
+    assert meta["version"] == 2 and meta["updates"][0]["ciphertexts_changed"] == changed
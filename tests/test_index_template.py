@@ -0,0 +1,48 @@
+import numpy as np
+from binary_template import BinaryTemplate
+from index_template import IndexTemplate
+
+
+def test_pack_unpack_round_trip():
+    positions = np.array([0, 1, 63, 64, 1000, IndexTemplate._index_factor - 1])
+    index = IndexTemplate.pack_index(positions)
+    assert index.dtype == np.dtype('<u8') and len(index) == IndexTemplate._index_words
+    assert np.array_equal(IndexTemplate.index_positions(index), positions)
+    assert IndexTemplate.unpack_index(index).sum() == len(positions)
+
+
+def test_parse_index_formats():
+    positions = np.array([2, 70, 4000])
+    index = IndexTemplate.pack_index(positions)
+    assert np.array_equal(IndexTemplate.parse_index(index.tobytes()), index)
+    vector = np.zeros(IndexTemplate._index_factor, dtype=int)
+    vector[positions] = 1
+    text = " ".join(str(i) for i in vector).encode("utf-8")  # The text format of older versions
+    assert np.array_equal(IndexTemplate.parse_index(text), index)
+
+
+def test_packed_matching_equals_the_vector_matching(finger, other_finger):
+    reference = IndexTemplate("alice", [finger() for _ in range(3)])
+    for query in (IndexTemplate(None, [finger()]), IndexTemplate(None, [other_finger()])):
+        ref_vector = IndexTemplate.unpack_index(reference.get_features()).astype(int)
+        query_vector = IndexTemplate.unpack_index(query.get_features()).astype(int)
+        assert IndexTemplate.match_templates(reference, query) == np.dot(ref_vector, query_vector) / query_vector.sum()
+
+
+def test_binary_matching_equals_the_set_matching(finger, other_finger):
+    reference = BinaryTemplate("alice", [finger() for _ in range(3)])
+    for query in (BinaryTemplate(None, [finger()]), BinaryTemplate(None, [other_finger()])):
+        ref_codes = set(reference.get_features().tolist())
+        query_codes = query.get_features().tolist()
+        assert BinaryTemplate.match_templates(reference, query) == len(ref_codes.intersection(query_codes)) / len(query_codes)
+
+
+def test_binary_and_index_round_trip(backend, finger):
+    binary = BinaryTemplate("alice", [finger() for _ in range(3)], reference=True)
+    stored = BinaryTemplate("alice", reference=True)
+    stored.read_template()
+    assert np.array_equal(stored.get_features(), binary.get_features())
+    IndexTemplate.write_template("alice", IndexTemplate.index_of(binary.get_features()))
+    index = IndexTemplate("alice", reference=True)
+    index.read_template()
+    assert np.array_equal(index.get_features(), IndexTemplate.index_of(binary.get_features()))
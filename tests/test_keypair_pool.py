@@ -0,0 +1,32 @@
+import os
+import stat
+from keypair_pool import KeypairPool
+from keyring_store import KeyringStore
+
+
+def test_take_hands_out_every_keypair_once(tmp_path):
+    pool = KeypairPool(str(tmp_path / "keypool.db"), n_length=256)
+    pool.fill(3)
+    assert len(pool) == 3
+    keys = [pool.take() for _ in range(3)]
+    assert len(set(k.public_key.n for k in keys)) == 3
+    assert all(k.p * k.q == k.public_key.n for k in keys)
+    assert pool.take() is None and len(pool) == 0
+    assert stat.S_IMODE(os.stat(tmp_path / "keypool.db").st_mode) == 0o600
+
+
+def test_generate_keypair_adds_to_the_keyring(tmp_path):
+    pool = KeypairPool(str(tmp_path / "keypool.db"), n_length=256)
+    keyring = KeyringStore(str(tmp_path / "keyring.db"))
+    pool.fill(1)
+    public_key, private_key = pool.generate_keypair(keyring)  # From the pool
+    assert len(pool) == 0 and keyring[public_key].p == private_key.p
+    public_key, _ = pool.generate_keypair(keyring)  # Generated inline, the pool is empty
+    assert public_key in keyring and len(keyring) == 2
+    assert public_key.n.bit_length() >= 255
+
+
+def test_keypairs_of_another_size_are_kept(tmp_path):
+    KeypairPool(str(tmp_path / "keypool.db"), n_length=256).fill(1)
+    assert KeypairPool(str(tmp_path / "keypool.db"), n_length=512).take() is None
+    assert KeypairPool(str(tmp_path / "keypool.db"), n_length=256).take() is not None
@@ -0,0 +1,21 @@
+from minutiae_cache import MinutiaeCache
+
+
+def test_entries_survive_a_reload(tmp_path):
+    path = str(tmp_path / "cache.dat")
+    cache = MinutiaeCache(path)
+    cache.put(MinutiaeCache.key(b"image", 500), b"minutiae")
+    assert MinutiaeCache(path).get(MinutiaeCache.key(b"image", 500)) == b"minutiae"
+    assert MinutiaeCache(path).get(MinutiaeCache.key(b"image", 1000)) is None  # The key depends on the DPI
+
+
+def test_compaction_keeps_the_entries_of_other_processes(tmp_path):
+    path = str(tmp_path / "cache.dat")
+    first, second = MinutiaeCache(path, max_bytes=100), MinutiaeCache(path, max_bytes=100)  # As two processes sharing the file
+    second.put(b"b" * 32, b"x" * 10)
+    first.put(b"a" * 32, b"x" * 10)
+    first.flush()
+    assert len(MinutiaeCache(path)) == 2
+    for i in range(12):  # Over the bound, the least recently used entries are dropped
+        first.put(bytes([i]) * 32, b"y" * 10)
+    assert sum(len(p) for p in MinutiaeCache(path)._entries.values()) <= 100
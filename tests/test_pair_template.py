@@ -0,0 +1,51 @@
+import numpy as np
+from pair_template import FingerprintTemplate
+from template_store import get_store, user_key
+
+
+def nested_loop_score(reference_pairs, query_pairs):
+    '''
+        The matching of older versions: every equal (query pair, reference pair) combination counts once
+    '''
+    matches = 0
+    for qpair in query_pairs.tolist():
+        for rpair in reference_pairs.tolist():
+            if qpair == rpair:
+                matches += 1
+    return matches / len(query_pairs)
+
+
+def test_pair_keys_round_trip():
+    rng = np.random.default_rng(0)
+    bits = FingerprintTemplate._key_field_bits
+    pairs = np.stack([rng.integers(0, 2**bits, 200), rng.integers(0, 2**bits, 200), rng.integers(0, 2**bits, 200),
+                      rng.integers(0, 2, 200), rng.integers(0, 2, 200)], axis=1)
+    assert np.array_equal(FingerprintTemplate._key_pairs(FingerprintTemplate._pair_keys(pairs)), pairs)
+
+
+def test_key_join_matches_the_nested_loops(finger, other_finger):
+    reference = FingerprintTemplate("alice", [finger() for _ in range(3)])
+    for query in (FingerprintTemplate(None, [finger()]), FingerprintTemplate(None, [other_finger()])):
+        expected = nested_loop_score(reference.get_features(), query.get_features())
+        assert FingerprintTemplate.match_templates(reference, query) == expected
+
+
+def test_key_join_counts_duplicate_pairs():
+    reference = FingerprintTemplate.from_features("alice", np.array([[1, 2, 3, 0, 1], [1, 2, 3, 0, 1], [4, 5, 6, 1, 0]]))
+    query = FingerprintTemplate.from_features(None, np.array([[1, 2, 3, 0, 1], [1, 2, 3, 0, 1], [7, 8, 9, 0, 0]]))
+    assert FingerprintTemplate.match_templates(reference, query) == nested_loop_score(reference.get_features(), query.get_features()) == 4 / 3
+
+
+def test_write_read_round_trip(backend, finger):
+    reference = FingerprintTemplate("alice", [finger() for _ in range(3)], reference=True)
+    stored = FingerprintTemplate("alice", reference=True)
+    stored.read_template()
+    assert np.array_equal(np.sort(FingerprintTemplate._pair_keys(stored.get_features())),
+                          np.sort(FingerprintTemplate._pair_keys(reference.get_features())))
+
+
+def test_text_templates_of_older_versions(assets):
+    get_store().put(user_key("alice"), "raw", b"12 3.000 4.000 0 1\n7 1.000 2.000 1 1\n")
+    stored = FingerprintTemplate("alice", reference=True)
+    stored.read_template()
+    assert stored.get_features().tolist() == [[12, 3, 4, 0, 1], [7, 1, 2, 1, 1]]
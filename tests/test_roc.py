@@ -0,0 +1,28 @@
+import numpy as np
+from roc import error_rates, equal_error_rate, threshold_at_far
+
+
+def test_error_rates():
+    scores = [0.1, 0.4, 0.35, 0.8]
+    genuine = [False, False, True, True]
+    thresholds, far, frr = error_rates(scores, genuine)
+    assert thresholds.tolist() == [0.1, 0.35, 0.4, 0.8]
+    assert far.tolist() == [1.0, 0.5, 0.5, 0.0]
+    assert frr.tolist() == [0.0, 0.0, 0.5, 0.5]
+
+
+def test_equal_error_rate_of_separated_scores():
+    eer, threshold = equal_error_rate([0.1, 0.2, 0.8, 0.9], [False, False, True, True])
+    assert eer == 0.0 and 0.2 < threshold <= 0.8
+
+
+def test_threshold_at_far():
+    scores = [0.1, 0.4, 0.35, 0.8]
+    genuine = [False, False, True, True]
+    assert threshold_at_far(scores, genuine, 0.5) == (0.35, 0.5, 0.0)
+    assert threshold_at_far(scores, genuine, 0.0) == (0.8, 0.0, 0.5)
+
+
+def test_threshold_at_an_unmet_far():
+    threshold, far, frr = threshold_at_far([0.5, 0.5], [True, False], 0.1)  # Equal scores, every threshold accepts the impostor
+    assert threshold == np.inf and (far, frr) == (0.0, 1.0)
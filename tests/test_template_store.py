@@ -0,0 +1,52 @@
+import os
+import sqlite3
+import pytest
+import template_store
+from template_store import TemplateStore, get_store, user_key
+
+
+def test_put_get_patch_map(backend):
+    store = get_store()
+    user = user_key("alice")
+    store.put(user, "raw", b"0123456789")
+    store.patch(user, "raw", [(2, b"ab"), (8, b"c")])
+    assert bytes(store.get(user, "raw")) == b"01ab4567c9"
+    view = store.map(user, "raw")
+    assert len(view) == 10 and bytes(view[2:5]) == b"ab4"
+    assert store.exists(user) and store.users() == [user]
+    with pytest.raises(FileNotFoundError):
+        store.get(user, "index")
+    store.delete(user)
+    assert not store.exists(user)
+
+
+def test_transactions_are_all_or_none(backend):
+    store = get_store()
+    store.put("u", "raw", b"old")
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.put("u", "raw", b"new")
+            store.put("u", "index", b"new")
+            raise RuntimeError
+    if backend == "sqlite":  # The directory store replaces files one at a time
+        assert bytes(store.get("u", "raw")) == b"old" and not store.get_many(["u"], "index")
+
+
+def test_sqlite_store_of_older_versions_is_converted(assets):
+    conn = sqlite3.connect(os.path.join(assets, template_store.store_file_name))
+    conn.execute("CREATE TABLE templates (user TEXT NOT NULL, kind TEXT NOT NULL, data BLOB NOT NULL, "
+                 "PRIMARY KEY (user, kind)) WITHOUT ROWID")
+    conn.execute("INSERT INTO templates VALUES ('u', 'raw', x'0102')")
+    conn.commit()
+    conn.close()
+    store = get_store()
+    assert bytes(store.get("u", "raw")) == b"\x01\x02"
+    assert bytes(store.map("u", "raw")[1:2]) == b"\x02"  # Served from the blob of the row
+
+
+def test_backends_implement_the_interface():
+    class Incomplete(TemplateStore):
+        def get(self, user, kind):
+            return b""
+    with pytest.raises(TypeError):
+        Incomplete()